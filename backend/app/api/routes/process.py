@@ -1,18 +1,45 @@
+import asyncio
 import base64
 import json
 import logging
 import os
+import sys
 from PIL import Image
 import io
 from pydantic import BaseModel
-from typing import Dict
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Response 
-from ...services import composition_service, ia_service, logo_service, zip_service
+from typing import Dict, List, Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Header, Request, Response 
+from fastapi.routing import APIRoute
+from ...services import (coalescing_service, composition_service, ia_service, logo_service, prerender_service,
+                         profiling_service, zip_service)
 from ...models.schemas import ClientLog
 from ...services.composition_service import FORMAT_CONFIG
 import shutil
 
-router = APIRouter()
+class ProfilingRoute(APIRoute):
+    """
+    Rotas que podem ser perfiladas sob demanda. Sem o header X-Profile-Token com o token
+    configurado, o handler original é chamado direto. O token não é aceito na URL, que
+    fica registrada nos logs de acesso.
+    """
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request: Request) -> Response:
+            token = request.headers.get('x-profile-token')
+            if not token or not profiling_service.is_authorized(token):
+                return await handler(request)
+            with profiling_service.profile_request(f"{request.method} {request.url.path}") as profile:
+                # O trabalho síncrono dos handlers roda no loop de eventos: amostra-o também.
+                with profile.track(anchor=sys._getframe()):
+                    response = await handler(request)
+            if profile.saved:
+                response.headers['X-Profile-Id'] = profile.id
+            return response
+
+        return profiled_handler
+
+router = APIRouter(route_class=ProfilingRoute)
 logger = logging.getLogger(__name__)
 LOGOS_BASE_PATH = "app/static/logos"
 FONTS_BASE_PATH = "app/static/fonts" 
@@ -26,6 +53,128 @@ class ZipRequest(BaseModel):
     campaign_id: str
     images: Dict[str, str]
 
+async def _read_campaign_files(images: Optional[List[UploadFile]], image_keys: Optional[str],
+                               imageA: Optional[UploadFile], imageB: Optional[UploadFile]) -> dict:
+    """
+    Lê as imagens da campanha. Aceita uma lista arbitrária em 'images' (com as chaves
+    usadas nas atribuições em 'image_keys' ou, na falta delas, os nomes dos arquivos)
+    e mantém compatibilidade com os campos imageA/imageB.
+    """
+    uploads = []
+    if images:
+        if image_keys:
+            try:
+                keys = json.loads(image_keys)
+            except json.JSONDecodeError:
+                raise HTTPException(status_code=400, detail="'image_keys' não é um JSON válido.")
+            if not isinstance(keys, list) or not all(isinstance(k, str) and k for k in keys):
+                raise HTTPException(status_code=400, detail="'image_keys' deve ser uma lista de chaves (texto).")
+        else:
+            keys = [f.filename for f in images]
+        if len(keys) != len(images):
+            raise HTTPException(status_code=400, detail="'image_keys' deve ter uma chave para cada imagem enviada.")
+        uploads.extend(zip(keys, images))
+    uploads.extend((key, upload) for key, upload in (("imageA", imageA), ("imageB", imageB)) if upload is not None)
+
+    # Chaves repetidas (p.ex. dois arquivos com o mesmo nome) fariam uma imagem sobrescrever a outra.
+    keys = [key for key, _ in uploads]
+    duplicated = sorted({str(k) for k in keys if keys.count(k) > 1})
+    if duplicated:
+        raise HTTPException(status_code=400, detail=f"Chaves de imagem repetidas: {', '.join(duplicated)}. Envie 'image_keys' com chaves distintas.")
+
+    files_bytes = {}
+    for key, upload in uploads:
+        files_bytes[key] = await upload.read()
+    if not files_bytes:
+        raise HTTPException(status_code=400, detail="Nenhuma imagem foi enviada.")
+    return files_bytes
+
+async def _read_prefetch_files(images: Optional[List[UploadFile]], image_keys: Optional[str],
+                               imageA: Optional[UploadFile], imageB: Optional[UploadFile],
+                               image_hashes: Optional[str]) -> tuple:
+    """
+    Imagens para a pré-renderização: as enviadas agora (guardadas no cache compartilhado)
+    mais as indicadas por SHA-256 em 'image_hashes', que o servidor já recebeu antes.
+    Retorna (files_bytes, chaves cujo hash não está no cache e precisam ser reenviadas).
+    """
+    hashes = {}
+    if image_hashes:
+        try:
+            hashes = json.loads(image_hashes)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="'image_hashes' não é um JSON válido.")
+        if not isinstance(hashes, dict) or not all(isinstance(k, str) and k and isinstance(v, str) for k, v in hashes.items()):
+            raise HTTPException(status_code=400, detail="'image_hashes' deve mapear cada chave de imagem para o seu SHA-256.")
+    uploaded = {}
+    if images or imageA is not None or imageB is not None:
+        uploaded = await _read_campaign_files(images, image_keys, imageA, imageB)
+    duplicated = sorted(set(hashes) & set(uploaded))
+    if duplicated:
+        raise HTTPException(status_code=400, detail=f"Chaves de imagem repetidas: {', '.join(duplicated)}. Envie cada imagem ou o seu hash, não ambos.")
+    if not hashes and not uploaded:
+        raise HTTPException(status_code=400, detail="Nenhuma imagem foi enviada.")
+
+    loop = asyncio.get_running_loop()
+    for image_bytes in uploaded.values():
+        await loop.run_in_executor(None, prerender_service.store_upload, image_bytes)
+    files_bytes, missing = dict(uploaded), []
+    for key, digest in hashes.items():
+        image_bytes = await loop.run_in_executor(None, prerender_service.load_upload, digest)
+        if image_bytes is None:
+            missing.append(key)
+        else:
+            files_bytes[key] = image_bytes
+    return files_bytes, missing
+
+async def _read_assignments(assignments: UploadFile, files_bytes: dict) -> dict:
+    """Lê as atribuições (formato -> chave de imagem) e confere se cada chave foi enviada."""
+    try:
+        assignments_dict = json.loads(await assignments.read())
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="'assignments' não é um JSON válido.")
+    if not isinstance(assignments_dict, dict):
+        raise HTTPException(status_code=400, detail="'assignments' deve mapear cada formato para uma chave de imagem.")
+    missing = sorted({str(key) for key in assignments_dict.values() if key and (not isinstance(key, str) or key not in files_bytes)})
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Atribuições para imagens não enviadas: {', '.join(missing)}.")
+    return assignments_dict
+
+def _campaign_request_key(files_bytes: dict, assignments: dict, selected_logos: list, overrides: dict, *extra) -> str:
+    """
+    Chave de coalescência de uma campanha: só entram as imagens atribuídas e os overrides
+    não vazios dos formatos atribuídos, para que requisições equivalentes coincidam.
+    """
+    assigned = {name: key for name, key in assignments.items() if key}
+    used_keys = sorted(set(assigned.values()) & set(files_bytes))
+    relevant_overrides = {name: overrides[name] for name in assigned if overrides.get(name)}
+    image_parts = [part for key in used_keys for part in (key, files_bytes[key])]
+    return coalescing_service.request_key(*image_parts, assigned, selected_logos, relevant_overrides, *extra)
+
+def _render_single_preview(image_bytes: bytes, fmt_config: dict, selected_logos: list, overrides: dict,
+                           quality: str, draft_scale: float) -> bytes:
+    logos_to_process = []
+    for logo_info in selected_logos:
+        try:
+            logo_path = os.path.join(LOGOS_BASE_PATH, logo_info['folder'], logo_info['filename'])
+            with open(logo_path, "rb") as f:
+                logos_to_process.append({'bytes': f.read()})
+        except Exception:
+            continue
+
+    image_to_process = Image.open(io.BytesIO(image_bytes))
+    analysis_to_use = ia_service.analyze(image_bytes, image_to_process)
+
+    composed_image, _ = composition_service.compose_single_format(
+        image_to_process,
+        analysis_to_use,
+        fmt_config,
+        logos_to_process,
+        overrides=overrides,
+        quality=quality,
+        draft_scale=draft_scale
+    )
+    return composition_service.encode_format(composed_image, fmt_config, quality)
+
 @router.post("/log-client-error")
 async def log_client_error(log: ClientLog):
     logger.error(f"--- ERRO RECEBIDO DO CLIENTE ---")
@@ -132,24 +281,40 @@ async def test_recognition(
 
 @router.post("/generate-previews")
 async def generate_previews(
-    imageA: UploadFile = File(...),
-    imageB: UploadFile = File(...),
+    images: Optional[List[UploadFile]] = File(None),
+    image_keys: Optional[str] = Form(None),
+    imageA: Optional[UploadFile] = File(None),
+    imageB: Optional[UploadFile] = File(None),
     assignments: UploadFile = File(...),
     selected_logos: str = Form(...),
-    overrides: UploadFile = File(...) 
+    overrides: UploadFile = File(...),
+    quality: str = Form("final"),
+    draft_scale: float = Form(composition_service.DRAFT_SCALE)
 ):
+    if quality not in composition_service.RENDER_TIERS:
+        raise HTTPException(status_code=400, detail=f"Qualidade de renderização '{quality}' inválida.")
+    if not 0 < draft_scale <= 1:
+        raise HTTPException(status_code=400, detail="draft_scale deve estar entre 0 e 1.")
+    files_bytes = await _read_campaign_files(images, image_keys, imageA, imageB)
+    assignments_dict = await _read_assignments(assignments, files_bytes)
     try:
-        files_bytes = { "imageA": await imageA.read(), "imageB": await imageB.read() }
-        assignments_dict = json.loads(await assignments.read())
         overrides_dict = json.loads(await overrides.read())
         selected_logos_list = json.loads(selected_logos)
 
-        composed_data = composition_service.compose_all_formats_assigned(
-            files_bytes,
-            assignments_dict,
-            selected_logos_list,
-            overrides=overrides_dict
-        )
+        request_key = _campaign_request_key(files_bytes, assignments_dict, selected_logos_list, overrides_dict,
+                                            'previews', quality, draft_scale)
+        composed_data = await prerender_service.claimed_result(request_key)
+        if composed_data is None:
+            composed_data = await coalescing_service.run(
+                request_key,
+                composition_service.compose_all_formats_assigned,
+                files_bytes,
+                assignments_dict,
+                selected_logos_list,
+                overrides=overrides_dict,
+                quality=quality,
+                draft_scale=draft_scale
+            )
         
         formats_map = {fmt['name']: fmt for fmt in composition_service.FORMAT_CONFIG}
         previews_data = {}
@@ -166,13 +331,90 @@ async def generate_previews(
         logger.error(f"Erro na rota /generate-previews: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno no servidor: {str(e)}")
     
+@router.post("/prefetch-previews")
+async def prefetch_previews(
+    images: Optional[List[UploadFile]] = File(None),
+    image_keys: Optional[str] = Form(None),
+    imageA: Optional[UploadFile] = File(None),
+    imageB: Optional[UploadFile] = File(None),
+    image_hashes: Optional[str] = Form(None),
+    assignments: UploadFile = File(...),
+    selected_logos: str = Form(...),
+    overrides: UploadFile = File(...),
+    quality: str = Form("final"),
+    draft_scale: float = Form(composition_service.DRAFT_SCALE)
+):
+    """
+    Agenda em segundo plano o que /generate-previews calcularia com os mesmos dados.
+    As imagens já enviadas podem vir só pelo SHA-256 em 'image_hashes'; as que o servidor
+    não tiver voltam em 'missing' e precisam ser reenviadas.
+    """
+    if quality not in composition_service.RENDER_TIERS:
+        raise HTTPException(status_code=400, detail=f"Qualidade de renderização '{quality}' inválida.")
+    if not 0 < draft_scale <= 1:
+        raise HTTPException(status_code=400, detail="draft_scale deve estar entre 0 e 1.")
+    files_bytes, missing = await _read_prefetch_files(images, image_keys, imageA, imageB, image_hashes)
+    if missing:
+        return {"scheduled": False, "missing": missing}
+    assignments_dict = await _read_assignments(assignments, files_bytes)
+    try:
+        overrides_dict = json.loads(await overrides.read())
+        selected_logos_list = json.loads(selected_logos)
+
+        request_key = _campaign_request_key(files_bytes, assignments_dict, selected_logos_list, overrides_dict,
+                                            'previews', quality, draft_scale)
+        scheduled = prerender_service.schedule(
+            request_key, files_bytes, assignments_dict, selected_logos_list,
+            overrides=overrides_dict, quality=quality, draft_scale=draft_scale
+        )
+        return {"scheduled": scheduled}
+    except Exception as e:
+        logger.error(f"Erro na rota /prefetch-previews: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Erro interno no servidor: {str(e)}")
+
+@router.post("/plan-layouts")
+async def plan_layouts(
+    images: Optional[List[UploadFile]] = File(None),
+    image_keys: Optional[str] = Form(None),
+    imageA: Optional[UploadFile] = File(None),
+    imageB: Optional[UploadFile] = File(None),
+    assignments: UploadFile = File(...),
+    selected_logos: str = Form(...),
+    overrides: UploadFile = File(...)
+):
+    files_bytes = await _read_campaign_files(images, image_keys, imageA, imageB)
+    assignments_dict = await _read_assignments(assignments, files_bytes)
+    try:
+        overrides_dict = json.loads(await overrides.read())
+        selected_logos_list = json.loads(selected_logos)
+
+        request_key = _campaign_request_key(files_bytes, assignments_dict, selected_logos_list, overrides_dict, 'layouts')
+        layouts = await coalescing_service.run(
+            request_key,
+            composition_service.plan_all_formats_assigned,
+            files_bytes,
+            assignments_dict,
+            selected_logos_list,
+            overrides=overrides_dict
+        )
+        return {"layouts": layouts}
+    except Exception as e:
+        logger.error(f"Erro na rota /plan-layouts: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Erro interno no servidor: {str(e)}")
+
 @router.post("/generate-single-preview")
 async def generate_single_preview(
     file: UploadFile = File(...),
     format_name: str = Form(...),
     selected_logos: str = Form(...),
-    overrides: UploadFile = File(...)
+    overrides: UploadFile = File(...),
+    quality: str = Form("final"),
+    draft_scale: float = Form(composition_service.DRAFT_SCALE)
 ):
+    if quality not in composition_service.RENDER_TIERS:
+        raise HTTPException(status_code=400, detail=f"Qualidade de renderização '{quality}' inválida.")
+    if not 0 < draft_scale <= 1:
+        raise HTTPException(status_code=400, detail="draft_scale deve estar entre 0 e 1.")
     try:
         fmt_config = next((fmt for fmt in FORMAT_CONFIG if fmt['name'] == format_name), None)
         if not fmt_config:
@@ -180,38 +422,39 @@ async def generate_single_preview(
 
         image_bytes = await file.read()
         overrides_dict = json.loads(await overrides.read())
-        
         selected_logos_list = json.loads(selected_logos)
-        logos_to_process = []
-        for logo_info in selected_logos_list:
-            try:
-                logo_path = os.path.join(LOGOS_BASE_PATH, logo_info['folder'], logo_info['filename'])
-                with open(logo_path, "rb") as f:
-                    logos_to_process.append({'bytes': f.read()})
-            except Exception:
-                continue
-
-        image_to_process = Image.open(io.BytesIO(image_bytes))
-        analysis_to_use = ia_service.analyze(image_bytes)
-
-        composed_image, _ = composition_service.compose_single_format(
-            image_to_process,
-            analysis_to_use,
-            fmt_config,
-            logos_to_process,
-            overrides=overrides_dict
-        )
-        
-        buffer = io.BytesIO()
-        composed_image.save(buffer, format='JPEG', quality=90)
-        buffer.seek(0)
 
-        return Response(content=buffer.getvalue(), media_type="image/jpeg")
+        request_key = coalescing_service.request_key(image_bytes, format_name, selected_logos_list, overrides_dict,
+                                                     quality, draft_scale)
+        image_jpeg = await coalescing_service.run(
+            request_key, _render_single_preview,
+            image_bytes, fmt_config, selected_logos_list, overrides_dict, quality, draft_scale
+        )
+        return Response(content=image_jpeg, media_type="image/jpeg")
 
     except Exception as e:
         logger.error(f"Erro na rota /generate-single-preview: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno no servidor: {str(e)}")
 
+@router.get("/coalescing-stats")
+async def get_coalescing_stats():
+    return coalescing_service.stats()
+
+@router.get("/prerender-stats")
+async def get_prerender_stats():
+    return prerender_service.stats()
+
+async def get_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    if not profiling_service.is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Token de perfil ausente ou inválido.")
+    content = profiling_service.load_profile(profile_id)
+    if content is None:
+        raise HTTPException(status_code=404, detail=f"Perfil '{profile_id}' não encontrado.")
+    return Response(content=content, media_type="text/plain")
+
+# A leitura de perfis usa o mesmo token, mas não deve ser perfilada.
+router.add_api_route("/profiles/{profile_id}", get_profile, methods=["GET"], route_class_override=APIRoute)
+
 @router.get("/list-logo-folders")
 async def get_logo_folders(query: str = ""):
     return logo_service.list_logo_folders(query)
@@ -219,31 +462,11 @@ async def get_logo_folders(query: str = ""):
 @router.post("/generate-zip")
 async def generate_zip(request: ZipRequest):
     try:
-        images_to_zip = {}
-        folder_name = f"images_{request.campaign_id}"
-
-        for filename, base64_data in request.images.items():
-            image_bytes = base64.b64decode(base64_data)
-            final_filename = filename
-
-            if filename == 'BRAND_LOGO.jpg':
-                final_filename = 'BRAND_LOGO.png'
-                try:
-                    img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
-                    png_buffer = io.BytesIO()
-                    img.save(png_buffer, format='PNG')
-                    image_bytes = png_buffer.getvalue()
-                except Exception as e:
-                    logger.error(f"Falha ao converter BRAND_LOGO para PNG: {e}")
-                    final_filename = filename
-            
-            zip_path = os.path.join(folder_name, final_filename)
-            images_to_zip[zip_path] = image_bytes
-        
+        images_to_zip = {filename: base64.b64decode(data) for filename, data in request.images.items()}
         if not images_to_zip:
             raise HTTPException(status_code=400, detail="Nenhuma imagem fornecida para o ZIP.")
 
-        zip_buffer = zip_service.create_zip_from_images(images_to_zip)
+        zip_buffer = zip_service.create_campaign_zip(request.campaign_id, images_to_zip)
         zip_filename = f"images_{request.campaign_id}.zip"
         
         headers = {'Content-Disposition': f'attachment; filename="{zip_filename}"'}
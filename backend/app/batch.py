@@ -0,0 +1,192 @@
+"""
+Renderização em lote, sem a interface web.
+
+    cd backend
+    python -m app.batch campanhas.json --output saida/ --workers 4
+
+O manifesto (JSON ou CSV) lista as campanhas. Cada uma vira images_<id>.zip na pasta de
+saída. O andamento é registrado em <saída>/progress.jsonl: ao rodar de novo com o mesmo
+manifesto, as campanhas já concluídas são puladas e as que falharam são tentadas outra vez.
+
+Manifesto JSON: uma lista (ou {"campaigns": [...]}) de objetos com
+    id           identificador da campanha (nome do ZIP)
+    images       {"chave": "caminho"} ou um único caminho (chave "imageA")
+    assignments  {"FORMATO.jpg": "chave"}; se omitido, todos os formatos usam a primeira imagem
+    logos        [{"folder": ..., "filename": ...}] ou ["pasta/arquivo.png", ...]
+    overrides    objeto de overrides por formato ou caminho de um arquivo JSON (opcional)
+
+Manifesto CSV: colunas id, images ("chave=caminho;chave=caminho" ou um caminho),
+assignments (JSON, opcional), logos ("pasta/arquivo.png;...") e overrides (caminho, opcional).
+Caminhos relativos são resolvidos a partir da pasta do manifesto.
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROGRESS_FILENAME = "progress.jsonl"
+
+def _split_list(value: str) -> list:
+    return [item.strip() for item in (value or '').split(';') if item.strip()]
+
+def _normalize_campaign(raw: dict, base_dir: str) -> dict:
+    """Converte uma linha do manifesto (JSON ou CSV) no formato usado pelos workers."""
+    def resolve(path): return os.path.normpath(os.path.join(base_dir, path))
+
+    campaign_id = str(raw.get('id') or '').strip()
+    if not campaign_id:
+        raise ValueError("campanha sem 'id'")
+
+    images = raw.get('images')
+    if isinstance(images, str):
+        entries = _split_list(images)
+        images = dict(e.split('=', 1) for e in entries) if all('=' in e for e in entries) else {'imageA': images.strip()}
+    if not images:
+        raise ValueError(f"campanha '{campaign_id}' sem imagens")
+    images = {key.strip(): resolve(path.strip()) for key, path in images.items()}
+
+    assignments = raw.get('assignments') or None
+    if isinstance(assignments, str): assignments = json.loads(assignments)
+
+    logos = raw.get('logos') or []
+    if isinstance(logos, str): logos = _split_list(logos)
+    normalized_logos = []
+    for entry in logos:
+        logo = entry if isinstance(entry, dict) else dict(zip(('folder', 'filename'), entry.split('/', 1)))
+        if not logo.get('folder') or not logo.get('filename'):
+            raise ValueError(f"campanha '{campaign_id}': o logo {entry!r} deve indicar pasta e arquivo (\"pasta/arquivo.png\")")
+        normalized_logos.append(logo)
+
+    overrides = raw.get('overrides') or {}
+    if isinstance(overrides, str):
+        with open(resolve(overrides), 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+
+    return {'id': campaign_id, 'images': images, 'assignments': assignments, 'logos': normalized_logos, 'overrides': overrides}
+
+def load_manifest(path: str) -> list:
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            data = json.load(f)
+            rows = data['campaigns'] if isinstance(data, dict) else data
+
+    campaigns = [_normalize_campaign(row, base_dir) for row in rows]
+    ids = [c['id'] for c in campaigns]
+    duplicated = sorted({i for i in ids if ids.count(i) > 1})
+    if duplicated:
+        raise ValueError(f"ids de campanha repetidos no manifesto: {', '.join(duplicated)}")
+    return campaigns
+
+def _read_progress(output_dir: str) -> dict:
+    """Último status registrado de cada campanha; linhas truncadas por uma interrupção são ignoradas."""
+    status = {}
+    path = os.path.join(output_dir, PROGRESS_FILENAME)
+    if not os.path.exists(path):
+        return status
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            status[entry['id']] = entry
+    return status
+
+def _record_progress(output_dir: str, entry: dict):
+    with open(os.path.join(output_dir, PROGRESS_FILENAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def _init_worker():
+    """Carrega uma vez por processo os serviços (e com eles o modelo YOLO)."""
+    # Um processo por núcleo: evita que cada worker também abra várias threads de cálculo.
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    os.chdir(BACKEND_DIR)
+    from .services import composition_service, ia_service  # noqa: F401
+    # Todas as análises do worker usam o modelo carregado na importação, sem criar cópias.
+    ia_service.MODEL_POOL_SIZE = 1
+
+def render_campaign(campaign: dict, output_dir: str) -> dict:
+    """Renderiza todos os formatos de uma campanha e grava o ZIP (executado nos workers)."""
+    from .services import composition_service, zip_service
+
+    started = time.perf_counter()
+    files_bytes = {}
+    for key, path in campaign['images'].items():
+        with open(path, 'rb') as f:
+            files_bytes[key] = f.read()
+
+    assignments = campaign['assignments']
+    if not assignments:
+        first_key = next(iter(files_bytes))
+        assignments = {f"{fmt['name']}.jpg": first_key for fmt in composition_service.FORMAT_CONFIG if fmt['name'] != 'ENTREGA'}
+
+    composed = composition_service.compose_all_formats_assigned(files_bytes, assignments, campaign['logos'], campaign['overrides'])
+    zip_buffer = zip_service.create_campaign_zip(campaign['id'], {name: data['image_bytes'] for name, data in composed.items()})
+
+    zip_path = os.path.join(output_dir, f"images_{campaign['id']}.zip")
+    temp_path = f"{zip_path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(zip_buffer.getvalue())
+    os.replace(temp_path, zip_path)
+    return {'id': campaign['id'], 'status': 'done', 'zip': os.path.basename(zip_path),
+            'formats': len(composed), 'seconds': round(time.perf_counter() - started, 2)}
+
+def run_batch(campaigns: list, output_dir: str, workers: int) -> dict:
+    """Renderiza as campanhas pendentes em um pool de processos e retorna a contagem por status."""
+    os.makedirs(output_dir, exist_ok=True)
+    progress = _read_progress(output_dir)
+    pending = [
+        c for c in campaigns
+        if progress.get(c['id'], {}).get('status') != 'done'
+        or not os.path.exists(os.path.join(output_dir, progress[c['id']].get('zip', '')))
+    ]
+    counts = {'done': 0, 'failed': 0, 'skipped': len(campaigns) - len(pending)}
+    logger.info(f"{len(pending)} campanha(s) a renderizar, {counts['skipped']} já concluída(s), {workers} worker(s).")
+    if not pending:
+        return counts
+
+    # 'spawn': o modelo não é herdado via fork; cada worker carrega o seu.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        futures = {pool.submit(render_campaign, c, output_dir): c['id'] for c in pending}
+        for future in as_completed(futures):
+            campaign_id = futures[future]
+            try:
+                entry = future.result()
+                logger.info(f"[{campaign_id}] {entry['formats']} formatos em {entry['seconds']}s -> {entry['zip']}")
+            except Exception as e:
+                entry = {'id': campaign_id, 'status': 'failed', 'error': str(e)}
+                logger.error(f"[{campaign_id}] falhou: {e}")
+            _record_progress(output_dir, entry)
+            counts[entry['status']] += 1
+    return counts
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Renderiza campanhas em lote a partir de um manifesto JSON ou CSV.")
+    parser.add_argument('manifest', help="arquivo .json ou .csv com as campanhas")
+    parser.add_argument('-o', '--output', default='batch_output', help="pasta dos ZIPs e do progress.jsonl")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="processos em paralelo")
+    args = parser.parse_args(argv)
+
+    campaigns = load_manifest(os.path.abspath(args.manifest))
+    output_dir = os.path.abspath(args.output)
+    os.chdir(BACKEND_DIR)
+    counts = run_batch(campaigns, output_dir, max(1, args.workers))
+    logger.info(f"Concluídas: {counts['done']}, falhas: {counts['failed']}, puladas: {counts['skipped']}.")
+    return 1 if counts['failed'] else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -9,6 +9,23 @@ class Settings(BaseSettings):
 
     JWT_SECRET_KEY: str
 
+    # Cache local compartilhado entre os workers do gunicorn (SQLite em modo WAL).
+    SHARED_CACHE_PATH: str = "cache/shared_cache.sqlite3"
+    SHARED_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+
+    # Diagnóstico: registra no log a memória alocada (tracemalloc) na renderização de cada formato.
+    # Os números só são confiáveis com uma renderização por vez no processo.
+    TRACE_RENDER_ALLOCATIONS: bool = False
+
+    # Perfil sob demanda: vazio desativa. Com um token, uma requisição envia o header
+    # X-Profile-Token (nunca na URL, que vai para os logs de acesso) e recebe em X-Profile-Id o id do perfil gravado.
+    PROFILING_TOKEN: str = ""
+    PROFILES_DIR: str = "cache/profiles"
+
+    # Pré-renderização em segundo plano assim que imagens e atribuições são escolhidas. O resultado
+    # fica no cache compartilhado (SHARED_CACHE_PATH), então vale para qualquer worker do gunicorn.
+    SPECULATIVE_PRERENDER: bool = True
+
     class Config:
         env_file = ".env.backend"
 
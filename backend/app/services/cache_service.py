@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Fração do limite para a qual o cache é reduzido quando o ultrapassa, evitando
+# uma nova limpeza a cada escrita.
+EVICTION_TARGET = 0.9
+BUSY_TIMEOUT_MS = 5000
+# Intervalo mínimo entre atualizações do horário de acesso de uma entrada: leituras frequentes
+# não disputam o lock de escrita, e a ordem de remoção perde no máximo essa precisão.
+ACCESS_REFRESH_SECONDS = 60
+
+_thread_local = threading.local()
+# Bancos (por processo e caminho) cujas tabelas e triggers já foram conferidos: a criação
+# toma o lock de escrita entre processos e não deve se repetir a cada nova thread.
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+def _connection() -> sqlite3.Connection:
+    """Conexão SQLite da thread atual; o modo WAL permite leituras concorrentes entre processos."""
+    conn = getattr(_thread_local, 'conn', None)
+    # Conexões SQLite não podem atravessar um fork (ex.: gunicorn com --preload).
+    if conn is None or _thread_local.pid != os.getpid():
+        directory = os.path.dirname(settings.SHARED_CACHE_PATH)
+        if directory: os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(settings.SHARED_CACHE_PATH, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        schema_key = (os.getpid(), settings.SHARED_CACHE_PATH)
+        with _schema_lock:
+            if schema_key not in _schema_ready:
+                _create_schema(conn)
+                _schema_ready.add(schema_key)
+        _thread_local.conn, _thread_local.pid = conn, os.getpid()
+    return conn
+
+def _create_schema(conn: sqlite3.Connection):
+    """
+    Cria as tabelas do cache. O total de bytes fica numa linha própria, atualizada por
+    triggers, para que as escritas não precisem somar a tabela inteira; bancos criados
+    antes dela são contados uma única vez, depois de criados os triggers.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+            " size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS entries_size_insert AFTER INSERT ON entries"
+            " BEGIN UPDATE cache_size SET total = total + NEW.size WHERE id = 0; END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS entries_size_update AFTER UPDATE OF size ON entries"
+            " BEGIN UPDATE cache_size SET total = total + NEW.size - OLD.size WHERE id = 0; END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS entries_size_delete AFTER DELETE ON entries"
+            " BEGIN UPDATE cache_size SET total = total - OLD.size WHERE id = 0; END"
+        )
+        conn.execute("INSERT OR IGNORE INTO cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+def content_key(*parts) -> str:
+    """Chave estável (SHA-256) a partir de bytes e/ou valores serializáveis em JSON."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=list).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def get(namespace: str, key: str) -> bytes:
+    """Retorna o valor em cache ou None. Falhas do cache nunca interrompem a requisição."""
+    try:
+        conn = _connection()
+        row = conn.execute("SELECT value, accessed FROM entries WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        if row is None: return None
+        now = time.time()
+        if now - row[1] > ACCESS_REFRESH_SECONDS:
+            conn.execute("UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+        return bytes(row[0])
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Falha ao ler o cache compartilhado ({namespace}): {e}")
+        return None
+
+def put(namespace: str, key: str, value: bytes):
+    """Grava um valor e, se o cache passar do limite, remove as entradas menos usadas."""
+    try:
+        conn = _connection()
+        # Upsert em vez de INSERT OR REPLACE: a remoção implícita do REPLACE não dispara triggers.
+        conn.execute(
+            "INSERT INTO entries (namespace, key, value, size, accessed) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, size = excluded.size, accessed = excluded.accessed",
+            (namespace, key, sqlite3.Binary(value), len(value), time.time())
+        )
+        total = conn.execute("SELECT total FROM cache_size WHERE id = 0").fetchone()[0]
+        if total > settings.SHARED_CACHE_MAX_BYTES:
+            _evict(conn, total - int(settings.SHARED_CACHE_MAX_BYTES * EVICTION_TARGET))
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Falha ao gravar no cache compartilhado ({namespace}): {e}")
+
+def delete(namespace: str, key: str):
+    """Remove uma entrada, se existir."""
+    try:
+        _connection().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Falha ao remover do cache compartilhado ({namespace}): {e}")
+
+def _evict(conn: sqlite3.Connection, bytes_to_free: int):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        freed = 0
+        rows = conn.execute("SELECT namespace, key, size FROM entries ORDER BY accessed").fetchall()
+        for namespace, key, size in rows:
+            if freed >= bytes_to_free: break
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            freed += size
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+def get_json(namespace: str, key: str):
+    value = get(namespace, key)
+    return json.loads(value) if value is not None else None
+
+def put_json(namespace: str, key: str, value):
+    put(namespace, key, json.dumps(value).encode('utf-8'))
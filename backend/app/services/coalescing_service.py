@@ -0,0 +1,59 @@
+import asyncio
+import functools
+import logging
+import threading
+from . import cache_service, prerender_service, profiling_service
+
+logger = logging.getLogger(__name__)
+
+# Computações em andamento por chave. Vale por processo: cada worker do gunicorn coalesce as suas.
+_in_flight = {}
+_stats = {"executed": 0, "coalesced": 0}
+_stats_lock = threading.Lock()
+
+def request_key(*parts) -> str:
+    """Chave da requisição a partir das entradas que determinam o resultado (bytes e/ou JSON)."""
+    return cache_service.content_key(*parts)
+
+def _count(counter: str):
+    with _stats_lock:
+        _stats[counter] += 1
+
+def _forget(key: str, task: asyncio.Future):
+    if _in_flight.get(key) is task:
+        del _in_flight[key]
+    # Marca a exceção como lida mesmo se todos os clientes já tiverem desistido.
+    if not task.cancelled(): task.exception()
+
+async def run(key: str, func, *args, **kwargs):
+    """
+    Executa func(*args, **kwargs) em uma thread, uma única vez por chave: requisições
+    idênticas que chegam enquanto a primeira ainda está em andamento aguardam o mesmo
+    resultado (ou a mesma exceção) em vez de repetir o trabalho. O resultado é
+    compartilhado e não deve ser modificado por quem o recebe.
+    """
+    with prerender_service.interactive():
+        return await _run(key, func, *args, **kwargs)
+
+async def _run(key: str, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    if profiling_service.is_active():
+        # Requisições com perfil fazem o próprio trabalho, para que o perfil mostre a renderização.
+        return await loop.run_in_executor(None, functools.partial(profiling_service.traced(func), *args, **kwargs))
+
+    task = _in_flight.get(key)
+    if task is None:
+        _count("executed")
+        task = asyncio.ensure_future(loop.run_in_executor(None, functools.partial(func, *args, **kwargs)))
+        _in_flight[key] = task
+        task.add_done_callback(functools.partial(_forget, key))
+    else:
+        _count("coalesced")
+        logger.info(f"Requisição idêntica em andamento; aguardando o mesmo resultado ({key[:12]}).")
+    # shield: se um cliente desconectar, a computação continua para os demais.
+    return await asyncio.shield(task)
+
+def stats() -> dict:
+    """Contadores de execuções reais e de requisições atendidas por coalescência."""
+    with _stats_lock:
+        return {**_stats, "in_flight": len(_in_flight)}
@@ -0,0 +1,101 @@
+import contextlib
+import logging
+import threading
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+def new_canvas(width: int, height: int, color: tuple = (255, 255, 255)) -> np.ndarray:
+    """Aloca o buffer RGB (altura, largura, 3) de um formato, já preenchido com a cor sólida."""
+    canvas = np.empty((height, width, 3), dtype=np.uint8)
+    canvas[...] = color[:3]
+    return canvas
+
+def _clip_region(canvas: np.ndarray, width: int, height: int, x: int, y: int) -> tuple:
+    """Interseção de um retângulo posicionado em (x, y) com o canvas: fatias de destino e de origem."""
+    canvas_h, canvas_w = canvas.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + width, canvas_w), min(y + height, canvas_h)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (slice(y0, y1), slice(x0, x1)), (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+
+def _blend(dst: np.ndarray, src, alpha):
+    """
+    Mistura src sobre dst no lugar, com a mesma aritmética inteira do Image.paste com máscara
+    do Pillow: (dst * (255 - a) + src * a) / 255, arredondado.
+    """
+    mixed = dst.astype(np.uint32)
+    mixed *= 255 - alpha
+    mixed += np.asarray(src, dtype=np.uint32) * alpha
+    mixed += 128
+    mixed += mixed >> 8
+    mixed >>= 8
+    dst[...] = mixed
+
+def paste(canvas: np.ndarray, image: Image.Image, x: int, y: int):
+    """Copia uma imagem opaca para o canvas na posição (x, y), recortando o que ficar de fora."""
+    region = _clip_region(canvas, image.width, image.height, x, y)
+    if region is None: return
+    (dst_y, dst_x), (src_y, src_x) = region
+    if image.mode != 'RGB': image = image.convert('RGB')
+    canvas[dst_y, dst_x] = np.asarray(image.crop((src_x.start, src_y.start, src_x.stop, src_y.stop)))
+
+def alpha_over(canvas: np.ndarray, image: Image.Image, x: int, y: int):
+    """Aplica uma imagem RGBA (ex.: logo) sobre o canvas usando o próprio canal alfa como máscara."""
+    region = _clip_region(canvas, image.width, image.height, x, y)
+    if region is None: return
+    (dst_y, dst_x), (src_y, src_x) = region
+    rgba = np.asarray(image.convert('RGBA'))[src_y, src_x]
+    alpha = rgba[..., 3:4].astype(np.uint32)
+    _blend(canvas[dst_y, dst_x], rgba[..., :3], alpha)
+
+def darken(canvas: np.ndarray, alpha: int, color: tuple = (0, 0, 0)):
+    """Cobre o canvas inteiro com uma cor de opacidade constante, no lugar, sem alocar overlay."""
+    for channel in range(3):
+        _blend(canvas[..., channel], color[channel], alpha)
+
+def to_image(canvas: np.ndarray) -> Image.Image:
+    """Imagem PIL RGB sobre o buffer do canvas."""
+    return Image.fromarray(canvas, 'RGB')
+
+# tracemalloc é global ao processo: medições simultâneas compartilham um único rastreamento,
+# iniciado pela primeira e encerrado pela última.
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started_here = False
+
+@contextlib.contextmanager
+def allocation_report(label: str, enabled: bool = True):
+    """
+    Modo de diagnóstico: mede com tracemalloc a memória alocada e o pico durante o bloco
+    e registra no log. As alocações internas do Pillow (fora do alocador do Python) não aparecem.
+    Os números só valem para renderizações em série: o rastreamento conta as alocações de
+    todas as threads, e o pico só é medido quando não há outra medição em andamento.
+    """
+    global _tracing_users, _tracing_started_here
+    if not enabled:
+        yield
+        return
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started_here = True
+        _tracing_users += 1
+        measures_peak = _tracing_users == 1
+        if measures_peak: tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+    try:
+        yield
+    finally:
+        with _tracing_lock:
+            current, peak = tracemalloc.get_traced_memory()
+            _tracing_users -= 1
+            measures_peak = measures_peak and _tracing_users == 0
+            if _tracing_users == 0 and _tracing_started_here:
+                tracemalloc.stop()
+                _tracing_started_here = False
+        peak_text = f"{(peak - before) / 1024:.1f} KiB" if measures_peak else "indisponível (medições simultâneas)"
+        logger.info(f"[alocação] {label}: líquido {(current - before) / 1024:.1f} KiB, pico {peak_text}")
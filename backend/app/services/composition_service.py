@@ -1,11 +1,16 @@
 from PIL import Image, ImageDraw, ImageFont, ImageOps
+import functools
+import hashlib
 import io
 import json
 import logging
+import math
 import os
 import re
 import numpy as np
-from . import ia_service
+from concurrent.futures import ThreadPoolExecutor
+from ..core.config import settings
+from . import compositing_service, encoding_service, framing_service, ia_service, logo_service, luminance_service, profiling_service
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,6 +19,20 @@ LOGOS_BASE_PATH = "app/static/logos"
 FONTS_BASE_PATH = "app/static/fonts"
 COMPOSER_LOGO_PATH = "app/static/logo-composer/logo.png"
 
+# Tiers de renderização: 'final' é o usado na exportação; 'draft' serve apenas
+# para pré-visualizações interativas, em escala reduzida e com encode mais leve.
+RENDER_TIERS = {
+    'final': {'resample': Image.Resampling.LANCZOS, 'reducing_gap': None, 'jpeg_quality': 90},
+    'draft': {'resample': Image.Resampling.BILINEAR, 'reducing_gap': 2.0, 'jpeg_quality': 70},
+}
+DRAFT_SCALE = 0.5
+LOGO_SPACING = 10
+IMAGE_WORKERS = min(8, os.cpu_count() or 1)
+
+# Comportamentos definidos pelo nome do formato, e não pelas regras do formats.json.
+SPLIT_LAYOUT_FORMATS = ['HOME_PRIVATE', 'HOME_PRIVATE_PUBLIC']
+DARK_OVERLAY_FORMATS = ['SLOT1_NEXT_WEB', 'SLOT1_NEXT_WEB_PRE']
+
 def load_format_config():
     try:
         with open("app/static/formats.json", "r", encoding="utf-8") as f:
@@ -52,29 +71,31 @@ def _parse_rgba_color(color_string: str) -> tuple:
         logger.error(f"Não foi possível parsear a cor '{color_string}': {e}")
     return 255, 255, 255, 255
 
-def _create_gradient_image(color_string: str, width: int, height: int) -> Image.Image:
-    """Cria uma imagem de gradiente a partir de uma string CSS."""
+def _fill_gradient(canvas: np.ndarray, color_string: str):
+    """Preenche o canvas, no lugar, com um gradiente a partir de uma string CSS."""
+    canvas_h, canvas_w = canvas.shape[:2]
     try:
         angle_match = re.search(r'(\d+)deg', color_string)
         angle = int(angle_match.group(1)) if angle_match else 90
         colors_rgba = [_parse_rgba_color(c) for c in re.findall(r'rgba?\([^)]+\)|#\w+', color_string)]
         
-        if len(colors_rgba) < 2: return Image.new('RGBA', (width, height), colors_rgba[0])
+        if len(colors_rgba) < 2:
+            canvas[...] = colors_rgba[0][:3]
+            return
 
         angle_rad = np.deg2rad(90 - angle)
-        x, y = np.linspace(-1, 1, width), np.linspace(-1, 1, height)
+        x, y = np.linspace(-1, 1, canvas_w), np.linspace(-1, 1, canvas_h)
         xv, yv = np.meshgrid(x, y)
         c, s = np.cos(angle_rad), np.sin(angle_rad)
         t = (c * xv + s * yv - (c * x.min() + s * y.min())) / ((c * x.max() + s * y.max()) - (c * x.min() + s * y.min()))
         
-        color_start, color_end = np.array(colors_rgba[0]), np.array(colors_rgba[-1])
-        gradient_array = color_start[None, None, :] * (1 - t)[:, :, None] + color_end[None, None, :] * t[:, :, None]
-        
-        return Image.fromarray(gradient_array.astype(np.uint8), 'RGBA')
+        # Um canal por vez: evita o array float (altura, largura, 4) intermediário.
+        color_start, color_end = colors_rgba[0], colors_rgba[-1]
+        for channel in range(3):
+            canvas[..., channel] = (color_start[channel] * (1 - t) + color_end[channel] * t).astype(np.uint8)
     except Exception as e:
         logger.error(f"Falha ao criar gradiente, usando cor sólida. Erro: {e}")
-        fallback_color = _parse_rgba_color(re.findall(r'rgba?\([^)]+\)|#\w+', color_string)[0])
-        return Image.new('RGBA', (width, height), fallback_color)
+        canvas[...] = _parse_rgba_color(re.findall(r'rgba?\([^)]+\)|#\w+', color_string)[0])[:3]
 
 def _apply_logo_color_filter(image: Image.Image, filter_name: str) -> Image.Image:
     """Aplica um filtro de cor (preto ou branco) a um logo."""
@@ -87,21 +108,25 @@ def _apply_logo_color_filter(image: Image.Image, filter_name: str) -> Image.Imag
     colorized_img.putalpha(alpha)
     return colorized_img
 
-def _apply_manual_image_override(canvas: Image.Image, original_image: Image.Image, overrides: dict):
+def _resize(image: Image.Image, size: tuple, quality: str = 'final') -> Image.Image:
+    """Redimensiona a imagem com o filtro de reamostragem do tier de renderização."""
+    tier = RENDER_TIERS[quality]
+    return image.resize(size, tier['resample'], reducing_gap=tier['reducing_gap'])
+
+def _apply_manual_image_override(canvas: np.ndarray, original_image: Image.Image, overrides: dict, quality: str = 'final'):
     """Aplica um recorte e redimensionamento manual na imagem."""
-    canvas_w, canvas_h = canvas.size
+    canvas_h, canvas_w = canvas.shape[:2]
     crop_x, crop_y = int(overrides.get('x', 0)), int(overrides.get('y', 0))
     crop_w, crop_h = int(overrides.get('width', original_image.width)), int(overrides.get('height', original_image.height))
     
     cropped_img = original_image.crop((crop_x, crop_y, crop_x + crop_w, crop_y + crop_h))
-    resized_for_canvas = cropped_img.resize((canvas_w, canvas_h), Image.Resampling.LANCZOS)
-    canvas.paste(resized_for_canvas, (0, 0))
+    compositing_service.paste(canvas, _resize(cropped_img, (canvas_w, canvas_h), quality), 0, 0)
 
-def _apply_automatic_composition(canvas: Image.Image, original_image: Image.Image, analysis: dict, fmt_config: dict) -> dict:
-    """Calcula e aplica o melhor enquadramento da imagem no canvas."""
+def _heuristic_composition(canvas_size: tuple, image_size: tuple, analysis: dict, fmt_config: dict) -> dict:
+    """Enquadramento por heurística: alinha o ponto de foco e o topo do sujeito à área de composição."""
     rules = fmt_config.get('rules', {})
-    canvas_w, canvas_h = canvas.size
-    image_w, image_h = original_image.size
+    canvas_w, canvas_h = canvas_size
+    image_w, image_h = image_size
     focus_x, focus_y = analysis['focus_point']
     main_box = analysis.get('main_box')
 
@@ -131,151 +156,331 @@ def _apply_automatic_composition(canvas: Image.Image, original_image: Image.Imag
     paste_x = max(canvas_w - new_w, min(paste_x, 0))
     paste_y = max(canvas_h - new_h, min(paste_y, 0))
     
-    resized_image = original_image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-    canvas.paste(resized_image, (paste_x, paste_y))
+    return {"scale": scale, "paste_x": paste_x, "paste_y": paste_y, "width": new_w, "height": new_h}
+
+def _framing_config(fmt_config: dict) -> dict:
+    """Formato efetivo da área de imagem enquadrada automaticamente (None se não houver imagem)."""
+    rules = fmt_config.get('rules', {})
+    if 'logo_only' in rules.get('type', ''):
+        return None
+    if fmt_config['name'] in SPLIT_LAYOUT_FORMATS:
+        return {'name': fmt_config['name'], 'width': fmt_config['width'] - rules.get('split_width', 300),
+                'height': fmt_config['height'], 'rules': {'type': 'full_bleed'}}
+    return fmt_config
+
+def _compute_automatic_compositions(image_size: tuple, analysis: dict, fmt_configs: list) -> list:
+    """Calcula o melhor enquadramento de vários formatos de uma vez, sem tocar nos pixels."""
+    heuristics = [_heuristic_composition((c['width'], c['height']), image_size, analysis, c) for c in fmt_configs]
+    return framing_service.optimize_framings(image_size, analysis, fmt_configs, heuristics)
+
+def _compute_automatic_composition(canvas_size: tuple, image_size: tuple, analysis: dict, fmt_config: dict) -> dict:
+    """Calcula o melhor enquadramento (escala e posição) sem tocar nos pixels."""
+    canvas_config = {**fmt_config, 'width': canvas_size[0], 'height': canvas_size[1]}
+    return _compute_automatic_compositions(image_size, analysis, [canvas_config])[0]
+
+def _precompute_framings(image_sizes: dict, analyses: dict, assignments: dict):
+    """Otimiza em lote o enquadramento de todos os formatos atribuídos a cada imagem."""
+    for image_key, image_size in image_sizes.items():
+        configs = [
+            _framing_config(fmt) for fmt in FORMAT_CONFIG
+            if fmt['name'] != 'ENTREGA' and assignments.get(f"{fmt['name']}.jpg") == image_key
+        ]
+        configs = [c for c in configs if c]
+        if configs: _compute_automatic_compositions(image_size, analyses[image_key], configs)
+
+def _apply_automatic_composition(canvas: np.ndarray, original_image: Image.Image, analysis: dict, fmt_config: dict,
+                                 quality: str = 'final') -> dict:
+    """Calcula e aplica o melhor enquadramento da imagem no canvas."""
+    canvas_h, canvas_w = canvas.shape[:2]
+    layout = _compute_automatic_composition((canvas_w, canvas_h), original_image.size, analysis, fmt_config)
+    scale, paste_x, paste_y = layout['scale'], layout['paste_x'], layout['paste_y']
+    
+    new_w, new_h = layout['width'], layout['height']
+    if quality == 'final':
+        # O tier final redimensiona a imagem inteira, para que a exportação não mude pixel algum.
+        compositing_service.paste(canvas, _resize(original_image, (new_w, new_h), quality), paste_x, paste_y)
+    else:
+        # No rascunho, redimensiona apenas a parte da imagem que fica visível no canvas.
+        x0, y0 = max(0, -paste_x), max(0, -paste_y)
+        x1, y1 = min(new_w, canvas_w - paste_x), min(new_h, canvas_h - paste_y)
+        if x1 > x0 and y1 > y0:
+            ratio_x, ratio_y = original_image.width / new_w, original_image.height / new_h
+            tier = RENDER_TIERS[quality]
+            visible = original_image.resize((x1 - x0, y1 - y0), tier['resample'],
+                                            box=(x0 * ratio_x, y0 * ratio_y, x1 * ratio_x, y1 * ratio_y),
+                                            reducing_gap=tier['reducing_gap'])
+            compositing_service.paste(canvas, visible, paste_x + x0, paste_y + y0)
     
     return {"scale": scale, "paste_x": paste_x, "paste_y": paste_y, "crop": {"x":0, "y":0}, "zoom": scale}
 
-
-def _compose_logo_only(fmt_config: dict, logos_data: list, overrides: dict) -> Image.Image:
-    canvas = Image.new('RGBA', (fmt_config['width'], fmt_config['height']), (255, 255, 255, 255))
+def _load_trimmed_logo(logo_bytes: bytes, color_filter: str = None) -> Image.Image:
+    """Abre o logo já sem a área transparente em volta (via cache) e aplica o filtro de cor."""
+    logo_img = logo_service.trimmed_logo_image(logo_bytes)
+    if color_filter: logo_img = _apply_logo_color_filter(logo_img, color_filter)
+    return logo_img
+
+@functools.lru_cache(maxsize=64)
+def _trimmed_logo_size(logo_bytes: bytes, color_filter: str = None) -> tuple:
+    """Dimensões do logo já recortado, em cache para o planejamento de layout."""
+    return _load_trimmed_logo(logo_bytes, color_filter).size
+
+def _thumbnail_size(size: tuple, max_size: tuple) -> tuple:
+    """Reproduz o cálculo de tamanho de Image.thumbnail sem redimensionar pixels."""
+    width, height = size
+    x, y = map(math.floor, max_size)
+    if x >= width and y >= height: return width, height
+
+    def round_aspect(number, key): return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if x / y >= aspect: x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else: y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return x, y
+
+def _logo_override(logo_overrides: list, index: int) -> dict:
+    return logo_overrides[index] if index < len(logo_overrides) else {}
+
+def _stack_logo_positions(logo_sizes: list, logo_overrides: list, default_x: int, start_y: int) -> list:
+    """Empilha os logos verticalmente, respeitando posições manuais quando houver."""
+    positions, current_y = [], start_y
+    for i, (_, logo_h) in enumerate(logo_sizes):
+        override = _logo_override(logo_overrides, i)
+        paste_x = int(override.get('x', default_x))
+        paste_y = int(override.get('y', current_y))
+        positions.append((paste_x, paste_y))
+        current_y = paste_y + logo_h + 15
+    return positions
+
+def _layout_of(fmt_config: dict) -> str:
+    """Layout de composição do formato: 'logo_only', 'split' ou 'standard'."""
+    if fmt_config.get('rules', {}).get('type', 'full_bleed') == 'logo_only_centered_white_bg': return 'logo_only'
+    return 'split' if fmt_config['name'] in SPLIT_LAYOUT_FORMATS else 'standard'
+
+def _logo_target(layout: str, rules: dict, override: dict, trimmed_size: tuple) -> tuple:
+    """
+    Caixa para a qual o logo recortado é redimensionado no layout. No layout padrão ela é o
+    limite de um thumbnail (que preserva a proporção e nunca amplia); nos demais, o tamanho final.
+    """
+    width, height = trimmed_size
+    if layout == 'standard':
+        logo_w = int(override.get('width', 150))
+        return logo_w, int(logo_w * height / width) if width > 0 else 0
+    target_w = override.get('width', rules.get('logo_area', {}).get('width', 150 if layout == 'logo_only' else 260))
+    return target_w, int(target_w * height / width)
+
+def _logo_final_size(layout: str, rules: dict, override: dict, trimmed_size: tuple) -> tuple:
+    """Tamanho do logo no formato, sem tocar nos pixels (mesma regra de _fit_logo)."""
+    target = _logo_target(layout, rules, override, trimmed_size)
+    return _thumbnail_size(trimmed_size, target) if layout == 'standard' else target
+
+def _fit_logo(logo_img: Image.Image, layout: str, rules: dict, override: dict, quality: str) -> Image.Image:
+    target = _logo_target(layout, rules, override, logo_img.size)
+    if layout == 'standard':
+        logo_img.thumbnail(target, RENDER_TIERS[quality]['resample'])
+        return logo_img
+    return _resize(logo_img, target, quality)
+
+def _logo_positions(layout: str, fmt_config: dict, logo_overrides: list, logo_sizes: list) -> list:
+    """Posições dos logos: centralizados lado a lado no layout só de logos, empilhados nos demais."""
+    rules = fmt_config.get('rules', {})
+    if layout == 'logo_only':
+        spacing = rules.get('logo_spacing', LOGO_SPACING)
+        current_x = (fmt_config['width'] - sum(w for w, _ in logo_sizes) - spacing * max(len(logo_sizes) - 1, 0)) / 2
+        positions = []
+        for logo_w, logo_h in logo_sizes:
+            positions.append((int(current_x), int((fmt_config['height'] - logo_h) / 2)))
+            current_x += logo_w + spacing
+        return positions
+    margin = rules.get('margin', {})
+    return _stack_logo_positions(logo_sizes, logo_overrides, margin.get('x', 20), margin.get('y', 40 if layout == 'split' else 20))
+
+def _tagline_anchor(tagline_overrides: dict, logo_pos: tuple, logo_size: tuple, canvas_h: int) -> tuple:
+    """Posição da tagline: manual, logo abaixo do primeiro logo ou no rodapé."""
+    pos_x = tagline_overrides.get('x', logo_pos[0] if logo_pos else 20)
+    pos_y = tagline_overrides.get('y', logo_pos[1] + logo_size[1] + 5 if logo_pos else canvas_h - 40)
+    return pos_x, pos_y
+
+def _compose_logo_only(fmt_config: dict, logos_data: list, overrides: dict, quality: str = 'final') -> Image.Image:
+    canvas = compositing_service.new_canvas(fmt_config['width'], fmt_config['height'])
     logo_overrides = overrides.get('logo', [])
+    rules = fmt_config.get('rules', {})
     
     processed_logos = []
-    total_width, spacing = 0, 10
     for i, logo_data in enumerate(logos_data):
-        override = logo_overrides[i] if i < len(logo_overrides) else {}
-        logo_img = Image.open(io.BytesIO(logo_data['bytes'])).convert("RGBA")
-        if override.get('color_filter'): logo_img = _apply_logo_color_filter(logo_img, override['color_filter'])
-        if logo_img.getbbox(): logo_img = logo_img.crop(logo_img.getbbox())
-        
-        target_w = override.get('width', fmt_config.get('rules', {}).get('logo_area', {}).get('width', 150))
-        logo_img = logo_img.resize((target_w, int(target_w * logo_img.height / logo_img.width)), Image.Resampling.LANCZOS)
-        
-        processed_logos.append(logo_img)
-        total_width += logo_img.width
-    
-    if len(processed_logos) > 1: total_width += spacing * (len(processed_logos) - 1)
+        override = _logo_override(logo_overrides, i)
+        logo_img = _load_trimmed_logo(logo_data['bytes'], override.get('color_filter'))
+        processed_logos.append(_fit_logo(logo_img, 'logo_only', rules, override, quality))
     
-    current_x = (fmt_config['width'] - total_width) / 2
-    for logo_img in processed_logos:
-        paste_y = (fmt_config['height'] - logo_img.height) / 2
-        canvas.paste(logo_img, (int(current_x), int(paste_y)), mask=logo_img)
-        current_x += logo_img.width + spacing
+    positions = _logo_positions('logo_only', fmt_config, logo_overrides, [img.size for img in processed_logos])
+    for logo_img, position in zip(processed_logos, positions):
+        compositing_service.alpha_over(canvas, logo_img, *position)
         
-    return canvas.convert('RGB')
+    return compositing_service.to_image(canvas)
 
-def _compose_split_layout(original_image: Image.Image, analysis: dict, fmt_config: dict, logos_data: list, overrides: dict) -> tuple:
+def _compose_split_layout(original_image: Image.Image, analysis: dict, fmt_config: dict, logos_data: list, overrides: dict,
+                          quality: str = 'final') -> tuple:
     rules = fmt_config.get('rules', {})
     canvas_w, canvas_h = fmt_config['width'], fmt_config['height']
     split_width = rules.get('split_width', 300)
     
-    canvas = Image.new('RGBA', (canvas_w, canvas_h), (255, 255, 255, 255))
-    image_canvas = Image.new('RGBA', (canvas_w - split_width, canvas_h))
+    canvas = compositing_service.new_canvas(canvas_w, canvas_h)
+    # A área da imagem é uma vista do próprio canvas: a imagem é escrita direto no buffer final.
+    image_canvas = canvas[:, split_width:]
+    image_canvas[...] = 0
     
     image_overrides = overrides.get('image')
     if image_overrides:
-        _apply_manual_image_override(image_canvas, original_image, image_overrides)
+        _apply_manual_image_override(image_canvas, original_image, image_overrides, quality)
         composition_data = {'scale': image_overrides.get('zoom'), 'crop': image_overrides.get('crop')}
     else:
-        temp_config = {'width': canvas_w - split_width, 'height': canvas_h, 'rules': {'type': 'full_bleed'}}
-        composition_data = _apply_automatic_composition(image_canvas, original_image, analysis, temp_config)
-        
-    canvas.paste(image_canvas, (split_width, 0))
+        composition_data = _apply_automatic_composition(image_canvas, original_image, analysis, _framing_config(fmt_config), quality)
     
     if logos_data:
         logo_overrides = overrides.get('logo', [])
-        current_y = rules.get('margin', {}).get('y', 40)
+        logo_images = []
         for i, logo_data in enumerate(logos_data):
-            override = logo_overrides[i] if i < len(logo_overrides) else {}
-            logo_img = Image.open(io.BytesIO(logo_data['bytes'])).convert("RGBA")
-            if override.get('color_filter'): logo_img = _apply_logo_color_filter(logo_img, override['color_filter'])
-            if logo_img.getbbox(): logo_img = logo_img.crop(logo_img.getbbox())
-            
-            target_w = override.get('width', rules.get('logo_area', {}).get('width', 260))
-            logo_img = logo_img.resize((target_w, int(target_w * logo_img.height / logo_img.width)), Image.Resampling.LANCZOS)
-            
-            paste_x = int(override.get('x', rules.get('margin', {}).get('x', 20)))
-            paste_y = int(override.get('y', current_y))
-            
-            canvas.paste(logo_img, (paste_x, paste_y), mask=logo_img)
-            current_y = paste_y + logo_img.height + 15
+            override = _logo_override(logo_overrides, i)
+            logo_img = _load_trimmed_logo(logo_data['bytes'], override.get('color_filter'))
+            logo_images.append(_fit_logo(logo_img, 'split', rules, override, quality))
+        
+        positions = _logo_positions('split', fmt_config, logo_overrides, [img.size for img in logo_images])
+        for logo_img, position in zip(logo_images, positions):
+            compositing_service.alpha_over(canvas, logo_img, *position)
             
-    return canvas.convert('RGB'), composition_data
+    return compositing_service.to_image(canvas), composition_data
 
-def _compose_standard_format(original_image: Image.Image, analysis: dict, fmt_config: dict, logos_data: list, overrides: dict) -> tuple:
+def _compose_standard_format(original_image: Image.Image, analysis: dict, fmt_config: dict, logos_data: list, overrides: dict,
+                             quality: str = 'final') -> tuple:
     """Compõe formatos padrão com imagem de fundo, logos e tagline."""
     rules = fmt_config.get('rules', {})
     canvas_w, canvas_h = fmt_config['width'], fmt_config['height']
-    canvas = Image.new('RGBA', (canvas_w, canvas_h), (255, 255, 255, 255))
+    canvas = compositing_service.new_canvas(canvas_w, canvas_h)
     
     background_override = overrides.get('background')
     if background_override:
         bg_type, bg_color = background_override.get('type'), background_override.get('color')
-        if bg_type == 'solid': canvas = Image.new('RGBA', (canvas_w, canvas_h), _parse_rgba_color(bg_color))
-        elif bg_type == 'gradient': canvas = _create_gradient_image(bg_color, canvas_w, canvas_h)
+        if bg_type == 'solid': canvas[...] = _parse_rgba_color(bg_color)[:3]
+        elif bg_type == 'gradient': _fill_gradient(canvas, bg_color)
     
     composition_data = None
     if 'logo_only' not in rules.get('type', '') and not background_override:
         image_overrides = overrides.get('image')
-        if image_overrides: _apply_manual_image_override(canvas, original_image, image_overrides)
-        else: composition_data = _apply_automatic_composition(canvas, original_image, analysis, fmt_config)
+        if image_overrides: _apply_manual_image_override(canvas, original_image, image_overrides, quality)
+        else: composition_data = _apply_automatic_composition(canvas, original_image, analysis, fmt_config, quality)
 
-    if fmt_config['name'] in ['SLOT1_NEXT_WEB', 'SLOT1_NEXT_WEB_PRE']:
-        overlay = Image.new('RGBA', canvas.size, (0,0,0,191))
-        canvas.paste(overlay, (0,0), mask=overlay)
+    if fmt_config['name'] in DARK_OVERLAY_FORMATS:
+        compositing_service.darken(canvas, 191)
 
     final_logo_pos, final_logo_size = None, None
     if logos_data and rules.get('type') != 'full_bleed':
         logo_overrides = overrides.get('logo', [])
-        current_y = rules.get('margin', {}).get('y', 20)
+        logo_images, color_filters = [], []
         for i, logo_data in enumerate(logos_data):
-            override = logo_overrides[i] if i < len(logo_overrides) else {}
-            logo_img = Image.open(io.BytesIO(logo_data['bytes'])).convert("RGBA")
-            if override.get('color_filter'): logo_img = _apply_logo_color_filter(logo_img, override['color_filter'])
-            if logo_img.getbbox(): logo_img = logo_img.crop(logo_img.getbbox())
-            
-            logo_w = int(override.get('width', 150))
-            logo_h = int(logo_w * logo_img.height / logo_img.width) if logo_img.width > 0 else 0
-            logo_img.thumbnail((logo_w, logo_h), Image.Resampling.LANCZOS)
-            
-            paste_x = int(override.get('x', rules.get('margin', {}).get('x', 20)))
-            paste_y = int(override.get('y', current_y))
-            canvas.paste(logo_img, (paste_x, paste_y), mask=logo_img)
-            
-            if i == 0: final_logo_pos, final_logo_size = (paste_x, paste_y), logo_img.size
-            current_y = paste_y + logo_img.height + 15
-
+            override = _logo_override(logo_overrides, i)
+            color_filters.append(override.get('color_filter', luminance_service.AUTO_FILTER))
+            logo_img = _load_trimmed_logo(logo_data['bytes'], color_filters[-1])
+            logo_images.append(_fit_logo(logo_img, 'standard', rules, override, quality))
+        
+        positions = _logo_positions('standard', fmt_config, logo_overrides, [img.size for img in logo_images])
+        if luminance_service.AUTO_FILTER in color_filters:
+            luminance_table = luminance_service.build_luminance_table(compositing_service.to_image(canvas))
+        for i, (logo_img, position) in enumerate(zip(logo_images, positions)):
+            if color_filters[i] == luminance_service.AUTO_FILTER:
+                logo_box = (position[0], position[1], position[0] + logo_img.width, position[1] + logo_img.height)
+                chosen_filter = luminance_service.pick_logo_filter(
+                    luminance_table, logo_box, luminance_service.logo_luminance(logo_img)
+                )
+                if chosen_filter: logo_img = _apply_logo_color_filter(logo_img, chosen_filter)
+            compositing_service.alpha_over(canvas, logo_img, *position)
+        final_logo_pos, final_logo_size = positions[0], logo_images[0].size
+
+    # O Pillow copia o buffer ao criar a imagem RGB; a tagline é desenhada nessa cópia final.
+    canvas = compositing_service.to_image(canvas)
     tagline_overrides = overrides.get('tagline')
     if tagline_overrides and tagline_overrides.get('text'):
         try:
             font = ImageFont.truetype(os.path.join(FONTS_BASE_PATH, tagline_overrides.get('font_filename')), tagline_overrides.get('font_size'))
             color = tuple(_parse_rgba_color(tagline_overrides.get('color')))
-            pos_x = tagline_overrides.get('x', final_logo_pos[0] if final_logo_pos else 20)
-            pos_y = tagline_overrides.get('y', final_logo_pos[1] + final_logo_size[1] + 5 if final_logo_pos else canvas_h - 40)
+            pos_x, pos_y = _tagline_anchor(tagline_overrides, final_logo_pos, final_logo_size, canvas_h)
             ImageDraw.Draw(canvas).text((pos_x, pos_y), tagline_overrides['text'], font=font, fill=color)
         except Exception as e: logger.error(f"Erro ao renderizar tagline: {e}")
 
-    return canvas.convert('RGB'), composition_data
+    return canvas, composition_data
 
 
 def compose_single_format(original_image: Image.Image, analysis: dict, fmt_config: dict, 
-                          logos_data: list, overrides: dict = None) -> tuple:
-    rule_type = fmt_config.get('rules', {}).get('type', 'full_bleed')
-    
-    if rule_type == 'logo_only_centered_white_bg':
-        img, data = _compose_logo_only(fmt_config, logos_data, overrides or {}), None
-    elif fmt_config['name'] in ['HOME_PRIVATE', 'HOME_PRIVATE_PUBLIC']:
-        img, data = _compose_split_layout(original_image, analysis, fmt_config, logos_data, overrides or {})
+                          logos_data: list, overrides: dict = None, quality: str = 'final',
+                          draft_scale: float = DRAFT_SCALE) -> tuple:
+    """
+    Compõe um formato. No tier 'draft' o formato é renderizado em escala reduzida
+    (draft_scale), mas o composition_data retornado continua nas coordenadas do tier 'final'.
+    """
+    overrides = overrides or {}
+    final_data = None
+    if quality == 'draft':
+        final_data, fmt_config, overrides = _draft_render_inputs(
+            original_image.size, analysis, fmt_config, logos_data, overrides, draft_scale
+        )
+
+    layout = _layout_of(fmt_config)
+    if layout == 'logo_only':
+        img, data = _compose_logo_only(fmt_config, logos_data, overrides, quality), None
+    elif layout == 'split':
+        img, data = _compose_split_layout(original_image, analysis, fmt_config, logos_data, overrides, quality)
     else:
-        img, data = _compose_standard_format(original_image, analysis, fmt_config, logos_data, overrides or {})
-        
+        img, data = _compose_standard_format(original_image, analysis, fmt_config, logos_data, overrides, quality)
+
+    if final_data: data = final_data
     return img, data
 
-def compose_all_formats_assigned(files_bytes: dict, assignments: dict, selected_logos: list, overrides: dict = None) -> dict:
-    analyses = {k: ia_service.analyze(v) for k, v in files_bytes.items()}
-    images = {k: Image.open(io.BytesIO(v)) for k, v in files_bytes.items()}
-    
+def _draft_render_inputs(image_size: tuple, analysis: dict, fmt_config: dict, logos_data: list,
+                         overrides: dict, draft_scale: float) -> tuple:
+    """
+    Prepara formato e overrides reduzidos para o tier 'draft'. Logos e tagline são fixados
+    nas posições calculadas para o tier 'final' e então escalados, para que o rascunho
+    seja uma miniatura fiel do resultado exportado.
+    """
+    def scaled(value): return int(round(value * draft_scale))
+    def scale_rules(value):
+        if isinstance(value, dict): return {k: scale_rules(v) for k, v in value.items()}
+        if isinstance(value, (int, float)) and not isinstance(value, bool): return scaled(value)
+        return value
+
+    plan = plan_single_format(image_size, analysis, fmt_config, logos_data, overrides)
+    rules = scale_rules({'logo_spacing': LOGO_SPACING, **fmt_config.get('rules', {})})
+    draft_config = {**fmt_config, 'width': max(1, scaled(fmt_config['width'])),
+                    'height': max(1, scaled(fmt_config['height'])), 'rules': rules}
+
+    logo_overrides = overrides.get('logo', [])
+    draft_overrides = {**overrides, 'logo': [
+        {**_logo_override(logo_overrides, i),
+         'x': scaled(logo['x']), 'y': scaled(logo['y']), 'width': max(1, scaled(logo['width']))}
+        for i, logo in enumerate(plan['logos'])
+    ]}
+    if plan['tagline']:
+        tagline = {**overrides['tagline'], 'x': scaled(plan['tagline']['x']), 'y': scaled(plan['tagline']['y'])}
+        if isinstance(tagline.get('font_size'), (int, float)): tagline['font_size'] = max(1, scaled(tagline['font_size']))
+        draft_overrides['tagline'] = tagline
+
+    final_data = None
+    image_plan = plan['image']
+    if image_plan and image_plan['mode'] == 'auto':
+        final_data = {"scale": image_plan['scale'], "paste_x": image_plan['paste_x'],
+                      "paste_y": image_plan['paste_y'], "crop": {"x": 0, "y": 0}, "zoom": image_plan['scale']}
+        # Fixa o recorte do tier 'final' para que o rascunho não reenquadre a imagem.
+        draft_overrides['image'] = {
+            'x': -image_plan['paste_x'] / image_plan['scale'], 'y': -image_plan['paste_y'] / image_plan['scale'],
+            'width': (fmt_config['width'] - image_plan['offset_x']) / image_plan['scale'],
+            'height': fmt_config['height'] / image_plan['scale']
+        }
+    return final_data, draft_config, draft_overrides
+
+def encode_format(image: Image.Image, fmt_config: dict, quality: str = 'final') -> bytes:
+    """Codifica um formato renderizado; o limite de bytes do formato só vale para o tier 'final'."""
+    return encoding_service.encode_jpeg(image, RENDER_TIERS[quality]['jpeg_quality'], fmt_config if quality == 'final' else None)
+
+def _read_selected_logos(selected_logos: list) -> list:
+    """Lê do disco os arquivos dos logos selecionados para a campanha."""
     logos_to_process = []
     for logo in selected_logos:
         try:
@@ -283,23 +488,79 @@ def compose_all_formats_assigned(files_bytes: dict, assignments: dict, selected_
                 logos_to_process.append({'bytes': f.read()})
         except Exception as e:
             logger.warning(f"Não foi possível ler o logo {logo['filename']}: {e}")
-
-    output_data = {}
+    return logos_to_process
+
+def _decode_and_analyze(image_bytes: bytes, decode: bool = True) -> tuple:
+    image = Image.open(io.BytesIO(image_bytes))
+    if decode: image.load()
+    return image, ia_service.analyze(image_bytes, image)
+
+def _load_campaign_images(files_bytes: dict, assignments: dict, decode: bool = True) -> tuple:
+    """
+    Decodifica e analisa as imagens atribuídas da campanha em paralelo. Uploads
+    idênticos são deduplicados pelo hash do conteúdo e processados uma única vez.
+    """
+    assigned_keys = set(assignments.values())
+    used_keys = [k for k in files_bytes if k in assigned_keys]
+    digests = {k: hashlib.sha256(files_bytes[k]).hexdigest() for k in used_keys}
+    unique_bytes = {digest: files_bytes[k] for k, digest in digests.items()}
+    if not unique_bytes:
+        return {}, {}
+
+    with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, len(unique_bytes))) as pool:
+        decode_and_analyze = profiling_service.traced(lambda b: _decode_and_analyze(b, decode))
+        loaded = dict(zip(unique_bytes, pool.map(decode_and_analyze, unique_bytes.values())))
+    images = {k: loaded[digest][0] for k, digest in digests.items()}
+    analyses = {k: loaded[digest][1] for k, digest in digests.items()}
+    return images, analyses
+
+def _render_signature(fmt_config: dict, assigned_key: str, fmt_overrides: dict) -> str:
+    """
+    Tudo o que determina os bytes de um formato renderizado. Formatos com a mesma assinatura
+    (ex.: as variantes *_PRE, que copiam as regras da origem) geram arquivos idênticos.
+    """
+    name = fmt_config['name']
+    return json.dumps([
+        fmt_config['width'], fmt_config['height'], fmt_config.get('rules', {}),
+        name in SPLIT_LAYOUT_FORMATS, name in DARK_OVERLAY_FORMATS,
+        fmt_config.get('max_bytes'), fmt_config.get('progressive'), fmt_config.get('optimize'),
+        assigned_key, fmt_overrides or {}
+    ], sort_keys=True, default=list)
+
+def compose_all_formats_assigned(files_bytes: dict, assignments: dict, selected_logos: list, overrides: dict = None,
+                                 quality: str = 'final', draft_scale: float = DRAFT_SCALE, yield_point=None) -> dict:
+    """
+    Renderiza todos os formatos atribuídos. yield_point, se informado, é chamado antes de
+    cada etapa pesada (análise e cada formato), permitindo que quem chama pause o trabalho.
+    """
+    overrides = overrides or {}
+    if yield_point: yield_point()
+    images, analyses = _load_campaign_images(files_bytes, assignments)
+    logos_to_process = _read_selected_logos(selected_logos)
+    _precompute_framings({k: img.size for k, img in images.items()}, analyses, assignments)
+
+    output_data, rendered = {}, {}
     for fmt_config in FORMAT_CONFIG:
         fmt_name = f"{fmt_config['name']}.jpg"
         if fmt_config['name'] == 'ENTREGA': continue
 
         assigned_key = assignments.get(fmt_name)
         if not assigned_key: continue
+
+        signature = _render_signature(fmt_config, assigned_key, overrides.get(fmt_name))
+        if signature in rendered:
+            output_data[fmt_name] = dict(rendered[signature])
+            continue
+        if yield_point: yield_point()
             
-        composed_img, comp_data = compose_single_format(
-            images[assigned_key], analyses[assigned_key], fmt_config, 
-            logos_to_process, overrides.get(fmt_name, {})
-        )
-        
-        buffer = io.BytesIO()
-        composed_img.save(buffer, format='JPEG', quality=90)
-        output_data[fmt_name] = {"image_bytes": buffer.getvalue(), "composition_data": comp_data}
+        with compositing_service.allocation_report(fmt_name, settings.TRACE_RENDER_ALLOCATIONS):
+            composed_img, comp_data = compose_single_format(
+                images[assigned_key], analyses[assigned_key], fmt_config, 
+                logos_to_process, overrides.get(fmt_name, {}),
+                quality=quality, draft_scale=draft_scale
+            )
+            image_bytes = encode_format(composed_img, fmt_config, quality)
+        output_data[fmt_name] = rendered[signature] = {"image_bytes": image_bytes, "composition_data": comp_data}
 
     required_for_entrega = ['SLOT1_WEB.jpg', 'SHOWROOM_MOBILE.jpg', 'HOME_PRIVATE.jpg']
     if all(comp in output_data for comp in required_for_entrega):
@@ -311,6 +572,114 @@ def compose_all_formats_assigned(files_bytes: dict, assignments: dict, selected_
     
     return output_data
 
+def _plan_logos(layout: str, fmt_config: dict, logo_overrides: list, trimmed_sizes: list, default_filter: str = None) -> list:
+    """Geometria dos logos pelas mesmas regras de tamanho e posição usadas na renderização."""
+    rules = fmt_config.get('rules', {})
+    sizes = [_logo_final_size(layout, rules, _logo_override(logo_overrides, i), size) for i, size in enumerate(trimmed_sizes)]
+    positions = _logo_positions(layout, fmt_config, logo_overrides, sizes)
+    return [
+        {"x": x, "y": y, "width": w, "height": h,
+         "color_filter": _logo_override(logo_overrides, i).get('color_filter', default_filter)}
+        for i, ((x, y), (w, h)) in enumerate(zip(positions, sizes))
+    ]
+
+def _plan_image(image_size: tuple, analysis: dict, fmt_config: dict, image_overrides: dict, offset_x: int = 0) -> dict:
+    if image_overrides:
+        return {
+            "mode": "manual", "offset_x": offset_x,
+            "crop": {
+                "x": int(image_overrides.get('x', 0)), "y": int(image_overrides.get('y', 0)),
+                "width": int(image_overrides.get('width', image_size[0])),
+                "height": int(image_overrides.get('height', image_size[1]))
+            }
+        }
+    layout = _compute_automatic_composition((fmt_config['width'], fmt_config['height']), image_size, analysis, fmt_config)
+    return {"mode": "auto", "offset_x": offset_x, **layout}
+
+def plan_single_format(image_size: tuple, analysis: dict, fmt_config: dict, logos_data: list, overrides: dict = None) -> dict:
+    """
+    Calcula apenas a geometria de um formato (enquadramento, logos e tagline),
+    espelhando compose_single_format sem redimensionar nem codificar pixels.
+    """
+    overrides = overrides or {}
+    rule_type = fmt_config.get('rules', {}).get('type', 'full_bleed')
+    layout = _layout_of(fmt_config)
+    canvas_w, canvas_h = fmt_config['width'], fmt_config['height']
+    logo_overrides = overrides.get('logo', [])
+    trimmed_sizes = [
+        _trimmed_logo_size(logo_data['bytes'], _logo_override(logo_overrides, i).get('color_filter'))
+        for i, logo_data in enumerate(logos_data)
+    ]
+    plan = {"width": canvas_w, "height": canvas_h, "type": rule_type,
+            "background": None, "image": None, "overlay": None, "logos": [], "tagline": None}
+
+    if layout == 'logo_only':
+        plan['logos'] = _plan_logos(layout, fmt_config, logo_overrides, trimmed_sizes)
+        plan['background'] = {"type": "solid", "color": "#ffffff"}
+        return plan
+
+    if layout == 'split':
+        split_width = fmt_config.get('rules', {}).get('split_width', 300)
+        plan['image'] = _plan_image(image_size, analysis, _framing_config(fmt_config), overrides.get('image'), offset_x=split_width)
+        plan['background'] = {"type": "solid", "color": "#ffffff"}
+        plan['logos'] = _plan_logos(layout, fmt_config, logo_overrides, trimmed_sizes)
+        return plan
+
+    background_override = overrides.get('background')
+    if background_override:
+        plan['background'] = {"type": background_override.get('type'), "color": background_override.get('color')}
+    elif 'logo_only' not in rule_type:
+        plan['image'] = _plan_image(image_size, analysis, fmt_config, overrides.get('image'))
+
+    if fmt_config['name'] in DARK_OVERLAY_FORMATS:
+        plan['overlay'] = {"color": [0, 0, 0, 191]}
+
+    if logos_data and rule_type != 'full_bleed':
+        plan['logos'] = _plan_logos(layout, fmt_config, logo_overrides, trimmed_sizes,
+                                    default_filter=luminance_service.AUTO_FILTER)
+
+    tagline_overrides = overrides.get('tagline')
+    if tagline_overrides and tagline_overrides.get('text'):
+        first_logo = plan['logos'][0] if plan['logos'] else None
+        pos_x, pos_y = _tagline_anchor(
+            tagline_overrides,
+            (first_logo['x'], first_logo['y']) if first_logo else None,
+            (first_logo['width'], first_logo['height']) if first_logo else None,
+            canvas_h
+        )
+        plan['tagline'] = {
+            "x": pos_x, "y": pos_y, "text": tagline_overrides['text'],
+            "font_filename": tagline_overrides.get('font_filename'),
+            "font_size": tagline_overrides.get('font_size'),
+            "color": tagline_overrides.get('color')
+        }
+    return plan
+
+def plan_all_formats_assigned(files_bytes: dict, assignments: dict, selected_logos: list, overrides: dict = None) -> dict:
+    """Gera o plano de layout de todos os formatos atribuídos, sem renderizar imagens."""
+    overrides = overrides or {}
+    images, analyses = _load_campaign_images(files_bytes, assignments, decode=False)
+    image_sizes = {k: img.size for k, img in images.items()}
+    logos_to_process = _read_selected_logos(selected_logos)
+    _precompute_framings(image_sizes, analyses, assignments)
+
+    output_data = {}
+    for fmt_config in FORMAT_CONFIG:
+        fmt_name = f"{fmt_config['name']}.jpg"
+        if fmt_config['name'] == 'ENTREGA': continue
+
+        assigned_key = assignments.get(fmt_name)
+        if not assigned_key: continue
+
+        plan = plan_single_format(
+            image_sizes[assigned_key], analyses[assigned_key], fmt_config,
+            logos_to_process, overrides.get(fmt_name, {})
+        )
+        plan['source'] = assigned_key
+        output_data[fmt_name] = plan
+
+    return output_data
+
 def _create_entrega_format(generated_images: dict, formats_config: dict) -> bytes:
     CANVAS_WIDTH, CANVAS_HEIGHT = 980, 1002
     MARGIN, GAP = 20, 20
@@ -336,9 +705,12 @@ def _create_entrega_format(generated_images: dict, formats_config: dict) -> byte
     img_slot1 = load_and_resize('SLOT1_WEB.jpg', TARGET_SLOT1_SIZE)
     img_showroom = load_and_resize('SHOWROOM_MOBILE.jpg', TARGET_SHOWROOM_SIZE)
     img_home_bytes = generated_images.get('HOME_PRIVATE.jpg', {}).get('image_bytes')
-    img_home = Image.open(io.BytesIO(img_home_bytes)) if img_home_bytes else Image.new('RGB', (940, 530), (240, 240, 240))
+    home_config = formats_config.get('HOME_PRIVATE', {})
+    home_size = (home_config.get('width', 940), home_config.get('height', 530))
+    img_home = Image.open(io.BytesIO(img_home_bytes)) if img_home_bytes else Image.new('RGB', home_size, (240, 240, 240))
+    if img_home.size != home_size: img_home = img_home.resize(home_size, Image.Resampling.LANCZOS)
 
-    home_rules = formats_config.get('HOME_PRIVATE', {}).get('rules', {})
+    home_rules = home_config.get('rules', {})
     draw_home = ImageDraw.Draw(img_home)
     menu_start_y = home_rules.get('margin', {}).get('y', 40) + home_rules.get('logo_area', {}).get('height', 100) + 40
     for item in ["Mais desejados ♡", "Categoria 1", "Categoria 2", "Categoria 3"]:
@@ -377,6 +749,4 @@ def _create_entrega_format(generated_images: dict, formats_config: dict) -> byte
     
     canvas.paste(img_home, (MARGIN, current_y))
 
-    buffer = io.BytesIO()
-    canvas.save(buffer, format='JPEG', quality=95)
-    return buffer.getvalue()
+    return encoding_service.encode_jpeg(canvas, 95, formats_config.get('ENTREGA'))
@@ -0,0 +1,66 @@
+import hashlib
+import io
+import logging
+from PIL import Image
+from . import cache_service
+
+logger = logging.getLogger(__name__)
+
+# Qualidade mínima aceita na busca; abaixo disso os artefatos ficam visíveis demais nos banners.
+MIN_JPEG_QUALITY = 30
+# Linhas por faixa ao calcular o hash dos pixels para a chave do cache.
+HASH_STRIP_ROWS = 64
+
+def _encode(image: Image.Image, quality: int, progressive: bool, optimize: bool) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, progressive=progressive, optimize=optimize)
+    return buffer.getvalue()
+
+def _pixels_digest(image: Image.Image) -> bytes:
+    """
+    SHA-256 dos pixels lidos em faixas horizontais. O Pillow não expõe o buffer da imagem
+    (np.asarray também passa por tobytes()), então isso evita uma cópia do quadro inteiro.
+    """
+    digest = hashlib.sha256()
+    for top in range(0, image.height, HASH_STRIP_ROWS):
+        digest.update(image.crop((0, top, image.width, min(top + HASH_STRIP_ROWS, image.height))).tobytes())
+    return digest.digest()
+
+def encode_jpeg(image: Image.Image, quality: int, fmt_config: dict = None) -> bytes:
+    """
+    Codifica a imagem em JPEG com as opções do formato. Se o formato define 'max_bytes',
+    a qualidade é a maior (até a nominal) cujo arquivo cabe no limite, achada por busca
+    binária; a qualidade escolhida fica em cache pelo formato e pelo conteúdo da imagem.
+    'progressive' e 'optimize' (tabelas Huffman otimizadas) são opcionais por formato.
+    """
+    fmt_config = fmt_config or {}
+    progressive, optimize = bool(fmt_config.get('progressive')), bool(fmt_config.get('optimize'))
+    max_bytes = fmt_config.get('max_bytes')
+    if not max_bytes:
+        return _encode(image, quality, progressive, optimize)
+
+    cache_key = cache_service.content_key(
+        [fmt_config.get('name'), max_bytes, quality, progressive, optimize, image.mode, image.size], _pixels_digest(image)
+    )
+    cached_quality = cache_service.get_json('jpeg_quality', cache_key)
+    if cached_quality is not None:
+        return _encode(image, cached_quality, progressive, optimize)
+
+    best_quality, data = quality, _encode(image, quality, progressive, optimize)
+    if len(data) > max_bytes:
+        best_quality, data = None, None
+        low, high = MIN_JPEG_QUALITY, quality - 1
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = _encode(image, middle, progressive, optimize)
+            if len(candidate) <= max_bytes:
+                best_quality, data, low = middle, candidate, middle + 1
+            else:
+                high = middle - 1
+        if data is None:
+            best_quality = min(MIN_JPEG_QUALITY, quality)
+            logger.warning(f"{fmt_config.get('name')}: nem a qualidade {best_quality} cabe em {max_bytes} bytes.")
+            data = _encode(image, best_quality, progressive, optimize)
+
+    cache_service.put_json('jpeg_quality', cache_key, best_quality)
+    return data
@@ -0,0 +1,207 @@
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from . import cache_service
+
+# Grade de candidatos avaliada por formato: SCALE_STEPS escalas x OFFSET_STEPS² posições.
+SCALE_STEPS = 10
+OFFSET_STEPS = 12
+MAX_ZOOM_FACTOR = 1.5
+
+# Pesos das penalidades usadas na pontuação de cada candidato.
+FACE_CLIP_WEIGHT = 4.0
+PERSON_CLIP_WEIGHT = 1.0
+FACE_LOGO_WEIGHT = 4.0
+PERSON_LOGO_WEIGHT = 1.0
+COMPOSITION_WEIGHT = 1.0
+FOCUS_WEIGHT = 1.0
+SUBJECT_SIZE_WEIGHT = 0.5
+ZOOM_WEIGHT = 0.25
+
+FRAMING_CACHE_SIZE = 256
+# Incrementar quando a grade, os pesos ou a pontuação mudarem, invalidando o cache compartilhado.
+FRAMING_VERSION = 1
+_framing_cache = OrderedDict()
+_framing_cache_lock = threading.Lock()
+
+def _subject_boxes(analysis: dict) -> tuple:
+    """Monta as caixas a avaliar (rostos e pessoas), seus pesos e quais são rostos."""
+    faces = [list(b) for b in analysis.get('face_boxes', [])]
+    persons = sorted((list(b) for b in analysis.get('person_boxes', [])),
+                     key=lambda b: (b[2] - b[0]) * (b[3] - b[1]), reverse=True)
+    if not faces and persons:
+        # Sem rosto detectado, o quarto superior da maior pessoa faz o papel da cabeça.
+        x1, y1, x2, y2 = persons[0]
+        faces = [[x1, y1, x2, y1 + (y2 - y1) / 4]]
+
+    boxes = faces + persons
+    weights = [1.0] * len(faces) + [1.0 if i == 0 else 0.5 for i in range(len(persons))]
+    is_face = [True] * len(faces) + [False] * len(persons)
+    return np.array(boxes, dtype=np.float64).reshape(-1, 4), np.array(weights), np.array(is_face)
+
+def _format_geometry(fmt_config: dict) -> dict:
+    """Extrai do formato as áreas de logo e de composição usadas na pontuação."""
+    rules = fmt_config.get('rules', {})
+    canvas_w, canvas_h = fmt_config['width'], fmt_config['height']
+    margin = rules.get('margin', {'x': 20, 'y': 20})
+    logo_area = rules.get('logo_area')
+    has_composition = 'composition_area' in rules and rules.get('type') != 'centered_logo'
+
+    logo_rect = (0, 0, 0, 0)
+    if logo_area:
+        logo_rect = (margin.get('x', 0), margin.get('y', 0),
+                     margin.get('x', 0) + logo_area.get('width', 0), margin.get('y', 0) + logo_area.get('height', 0))
+
+    composition_rect, target_x = (0, 0, canvas_w, canvas_h), canvas_w / 2
+    if has_composition:
+        logo_w = (logo_area or {}).get('width', 0)
+        composition_rect = (margin.get('x', 0) + logo_w + margin.get('y', 0), margin.get('y', 0),
+                            canvas_w - margin.get('y', 0), canvas_h - margin.get('y', 0))
+        target_x = (composition_rect[0] + composition_rect[2]) / 2
+
+    return {"canvas": (canvas_w, canvas_h), "logo_rect": logo_rect, "composition_rect": composition_rect,
+            "has_composition": has_composition, "target_x": target_x}
+
+def _candidate_grid(canvas_size: tuple, image_size: tuple, heuristic: dict) -> np.ndarray:
+    """Gera os candidatos (escala, paste_x, paste_y) de um formato; o índice 0 é a heurística."""
+    canvas_w, canvas_h = canvas_size
+    image_w, image_h = image_size
+    min_scale = max(canvas_w / image_w, canvas_h / image_h)
+    max_scale = max(heuristic['scale'], min_scale) * MAX_ZOOM_FACTOR
+
+    scales = np.geomspace(min_scale, max_scale, SCALE_STEPS)
+    new_w, new_h = np.floor(image_w * scales), np.floor(image_h * scales)
+    steps = np.linspace(0, 1, OFFSET_STEPS)
+    paste_x = np.round((canvas_w - new_w)[:, None] * steps[None, :])
+    paste_y = np.round((canvas_h - new_h)[:, None] * steps[None, :])
+
+    grid = np.empty((SCALE_STEPS, OFFSET_STEPS, OFFSET_STEPS, 3))
+    grid[..., 0] = scales[:, None, None]
+    grid[..., 1] = paste_x[:, :, None]
+    grid[..., 2] = paste_y[:, None, :]
+    seed = np.array([[heuristic['scale'], heuristic['paste_x'], heuristic['paste_y']]])
+    return np.concatenate([seed, grid.reshape(-1, 3)])
+
+def _overlap_fraction(x1, y1, x2, y2, rect) -> np.ndarray:
+    """Fração da área de cada caixa que cai dentro do retângulo (arrays com broadcast)."""
+    rx1, ry1, rx2, ry2 = rect
+    inter_w = np.clip(np.minimum(x2, rx2) - np.maximum(x1, rx1), 0, None)
+    inter_h = np.clip(np.minimum(y2, ry2) - np.maximum(y1, ry1), 0, None)
+    area = np.maximum((x2 - x1) * (y2 - y1), 1e-9)
+    return inter_w * inter_h / area
+
+def _score_candidates(candidates: np.ndarray, geometries: list, image_size: tuple, analysis: dict) -> np.ndarray:
+    """
+    Pontua em lote todos os candidatos de todos os formatos.
+    candidates tem forma (formatos, candidatos, 3); o resultado, (formatos, candidatos).
+    """
+    boxes, weights, is_face = _subject_boxes(analysis)
+    scale = candidates[..., 0][..., None]
+    paste_x = candidates[..., 1][..., None]
+    paste_y = candidates[..., 2][..., None]
+
+    def per_format(key, index=None):
+        values = [g[key] if index is None else g[key][index] for g in geometries]
+        return np.array(values, dtype=np.float64)[:, None, None]
+
+    canvas_w, canvas_h = per_format('canvas', 0), per_format('canvas', 1)
+    logo_rect = tuple(per_format('logo_rect', i) for i in range(4))
+    composition_rect = tuple(per_format('composition_rect', i) for i in range(4))
+    has_composition = per_format('has_composition')[..., 0]
+
+    x1, y1 = boxes[:, 0] * scale + paste_x, boxes[:, 1] * scale + paste_y
+    x2, y2 = boxes[:, 2] * scale + paste_x, boxes[:, 3] * scale + paste_y
+
+    clip_weights = np.where(is_face, FACE_CLIP_WEIGHT, PERSON_CLIP_WEIGHT) * weights
+    logo_weights = np.where(is_face, FACE_LOGO_WEIGHT, PERSON_LOGO_WEIGHT) * weights
+    visible = _overlap_fraction(x1, y1, x2, y2, (0, 0, canvas_w, canvas_h))
+    under_logo = _overlap_fraction(x1, y1, x2, y2, logo_rect)
+    in_composition = _overlap_fraction(x1, y1, x2, y2, composition_rect)
+
+    penalty = ((1 - visible) * clip_weights).sum(axis=-1)
+    penalty += (under_logo * logo_weights).sum(axis=-1)
+    penalty += COMPOSITION_WEIGHT * has_composition * ((1 - in_composition) * weights).sum(axis=-1) / weights.sum()
+
+    scale, paste_x, paste_y = scale[..., 0], paste_x[..., 0], paste_y[..., 0]
+    canvas_w, canvas_h, has_composition = canvas_w[..., 0], canvas_h[..., 0], has_composition
+    focus_x, focus_y = analysis['focus_point']
+    focus_cx, focus_cy = focus_x * scale + paste_x, focus_y * scale + paste_y
+    target_x = per_format('target_x')[..., 0]
+    focus_dist = np.where(has_composition, np.abs(focus_cx - target_x) / canvas_w,
+                          np.hypot((focus_cx - canvas_w / 2) / canvas_w, (focus_cy - canvas_h / 2) / canvas_h))
+    penalty += FOCUS_WEIGHT * focus_dist
+
+    main_box = analysis.get('main_box')
+    if main_box:
+        target_h = np.maximum(composition_rect[3][..., 0] - composition_rect[1][..., 0], 1)
+        subject_h = max(main_box[3] - main_box[1], 1) * scale
+        penalty += SUBJECT_SIZE_WEIGHT * has_composition * np.abs(np.log(subject_h / target_h))
+
+    image_w, image_h = image_size
+    min_scale = np.maximum(canvas_w / image_w, canvas_h / image_h)
+    penalty += ZOOM_WEIGHT * np.log(scale / min_scale)
+    return -penalty
+
+def _cache_key(image_size: tuple, analysis: dict, fmt_config: dict) -> str:
+    return json.dumps([
+        FRAMING_VERSION, image_size, analysis['focus_point'], analysis.get('main_box'), analysis.get('subject_top_y'),
+        analysis.get('person_boxes', []), analysis.get('face_boxes', []),
+        fmt_config['width'], fmt_config['height'], fmt_config.get('rules', {})
+    ], sort_keys=True, default=list)
+
+def optimize_framings(image_size: tuple, analysis: dict, fmt_configs: list, heuristics: list) -> list:
+    """
+    Escolhe escala e posição de cada formato avaliando uma grade de candidatos contra
+    rostos, pessoas, área do logo e área de composição. Todos os formatos são pontuados
+    juntos, em uma única avaliação vetorizada; a heurística original entra como candidato
+    e é mantida quando nenhum outro é melhor ou quando não há pessoas detectadas.
+    """
+    results = list(heuristics)
+    if not analysis.get('person_boxes') and not analysis.get('face_boxes'):
+        return results
+
+    keys = [_cache_key(image_size, analysis, c) for c in fmt_configs]
+    pending = []
+    with _framing_cache_lock:
+        for i, key in enumerate(keys):
+            if key in _framing_cache:
+                _framing_cache.move_to_end(key)
+                results[i] = _framing_cache[key]
+            else:
+                pending.append(i)
+
+    still_pending = []
+    for i in pending:
+        shared = cache_service.get_json('framing', cache_service.content_key(keys[i]))
+        if shared is None:
+            still_pending.append(i)
+            continue
+        results[i] = shared
+        with _framing_cache_lock:
+            _framing_cache[keys[i]] = shared
+    pending = still_pending
+    if not pending:
+        return results
+
+    geometries = [_format_geometry(fmt_configs[i]) for i in pending]
+    candidates = np.stack([
+        _candidate_grid(geometries[j]['canvas'], image_size, heuristics[i]) for j, i in enumerate(pending)
+    ])
+    best = np.argmax(_score_candidates(candidates, geometries, image_size, analysis), axis=1)
+
+    image_w, image_h = image_size
+    for j, i in enumerate(pending):
+        if best[j] == 0:
+            layout = heuristics[i]
+        else:
+            scale, paste_x, paste_y = candidates[j, best[j]]
+            layout = {"scale": float(scale), "paste_x": int(paste_x), "paste_y": int(paste_y),
+                      "width": int(image_w * scale), "height": int(image_h * scale)}
+        results[i] = layout
+        cache_service.put_json('framing', cache_service.content_key(keys[i]), layout)
+        with _framing_cache_lock:
+            _framing_cache[keys[i]] = layout
+            while len(_framing_cache) > FRAMING_CACHE_SIZE:
+                _framing_cache.popitem(last=False)
+    return results
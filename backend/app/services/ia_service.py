@@ -1,9 +1,15 @@
+import contextlib
+import hashlib
 import io
 import logging
+import os
+import threading
+from collections import OrderedDict
 from PIL import Image, ImageDraw
 import numpy as np
 from ultralytics import YOLO
 import cv2
+from . import cache_service
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,16 +22,130 @@ except Exception as e:
     logger.error(f"ERRO ao carregar o modelo YOLO de '{MODEL_PATH}': {e}")
     model = None
 
-def analyze(image_bytes: bytes) -> dict:
+# O modelo YOLO (COCO) não tem classe de rosto; os rostos são procurados com um
+# classificador Haar do OpenCV apenas dentro das caixas de pessoa, em recortes reduzidos.
+FACE_ROI_MAX_SIDE = 320
+FACE_ROI_TOP_FRACTION = 0.6
+try:
+    FACE_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+    face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
+    if face_cascade.empty():
+        raise IOError("arquivo do classificador vazio ou ausente")
+    logger.info(f"Classificador de rostos carregado de: {FACE_CASCADE_PATH}")
+except Exception as e:
+    logger.error(f"ERRO ao carregar o classificador de rostos: {e}")
+    face_cascade = None
+
+# Nem o YOLO nem o classificador do OpenCV são seguros para chamadas concorrentes: cada
+# análise retira do pool um par (modelo, classificador) e o devolve ao terminar. O par carregado
+# na importação é o primeiro do pool; novos pares só são criados sob concorrência real, até
+# MODEL_POOL_SIZE, e ficam guardados para as próximas chamadas.
+MODEL_POOL_SIZE = min(8, os.cpu_count() or 1)
+_pool_condition = threading.Condition()
+_idle_instances = [(model, face_cascade)] if model else []
+_created_instances = len(_idle_instances)
+
+def _load_instances() -> tuple:
+    cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH) if face_cascade is not None else None
+    return YOLO(MODEL_PATH), cascade
+
+@contextlib.contextmanager
+def _checkout_instances():
+    global _created_instances
+    with _pool_condition:
+        while not _idle_instances and _created_instances >= MODEL_POOL_SIZE:
+            _pool_condition.wait()
+        instances = _idle_instances.pop() if _idle_instances else None
+        if instances is None: _created_instances += 1
+    if instances is None:
+        try:
+            instances = _load_instances()
+            logger.info(f"Nova instância do modelo carregada para análises concorrentes ({_created_instances}/{MODEL_POOL_SIZE}).")
+        except Exception:
+            with _pool_condition:
+                _created_instances -= 1
+                _pool_condition.notify()
+            raise
+    try:
+        yield instances
+    finally:
+        with _pool_condition:
+            _idle_instances.append(instances)
+            _pool_condition.notify()
+
+ANALYSIS_CACHE_SIZE = 32
+# Incrementar quando o formato ou a lógica da análise mudar, invalidando o cache compartilhado.
+ANALYSIS_VERSION = 2
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+def analyze(image_bytes: bytes, image: Image.Image = None) -> dict:
     """
     Analisa uma imagem para detectar pessoas e rostos, determinando um ponto de foco.
+    Os resultados ficam em cache pelo hash do conteúdo da imagem: um LRU no processo
+    e, atrás dele, o cache compartilhado entre os workers.
+    """
+    cache_key = f"{ANALYSIS_VERSION}:{hashlib.sha256(image_bytes).hexdigest()}"
+    with _analysis_cache_lock:
+        if cache_key in _analysis_cache:
+            _analysis_cache.move_to_end(cache_key)
+            return _analysis_cache[cache_key]
+
+    analysis = cache_service.get_json('analysis', cache_key)
+    if analysis is None:
+        analysis = _run_analysis(image_bytes, image)
+        cache_service.put_json('analysis', cache_key, analysis)
+    with _analysis_cache_lock:
+        _analysis_cache[cache_key] = analysis
+        while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return analysis
+
+def _detect_faces_in_person_boxes(image: Image.Image, person_boxes: list, cascade) -> list:
+    """
+    Procura rostos apenas na parte superior de cada caixa de pessoa, em recortes
+    reduzidos e em tons de cinza, e devolve as caixas nas coordenadas da imagem original.
     """
+    if cascade is None or not person_boxes:
+        return []
+
+    face_boxes = []
+    for x1, y1, x2, y2 in person_boxes:
+        roi_h = int((y2 - y1) * FACE_ROI_TOP_FRACTION)
+        if x2 - x1 < 8 or roi_h < 8: continue
+
+        # Recorta antes de converter: só os pixels do recorte passam para tons de cinza.
+        roi = image.crop((x1, y1, x2, y1 + roi_h)).convert('L')
+        ratio = min(1.0, FACE_ROI_MAX_SIDE / max(roi.size))
+        if ratio < 1.0:
+            roi = roi.resize((max(1, int(roi.width * ratio)), max(1, int(roi.height * ratio))), Image.Resampling.BILINEAR)
+
+        roi_array = cv2.equalizeHist(np.asarray(roi, dtype=np.uint8))
+        min_side = max(12, int(min(roi.size) * 0.15))
+        detections = cascade.detectMultiScale(roi_array, scaleFactor=1.1, minNeighbors=5, minSize=(min_side, min_side))
+        for fx, fy, fw, fh in detections:
+            face_boxes.append([
+                int(x1 + fx / ratio), int(y1 + fy / ratio),
+                int(x1 + (fx + fw) / ratio), int(y1 + (fy + fh) / ratio)
+            ])
+    return face_boxes
+
+def _run_analysis(image_bytes: bytes, image: Image.Image = None) -> dict:
+    """Executa o modelo YOLO sobre a imagem (já decodificada, se informada) e monta o dicionário de análise."""
     if not model:
         raise RuntimeError("Modelo YOLO não foi carregado. A análise não pode continuar.")
 
-    image = Image.open(io.BytesIO(image_bytes))
-    results = model(image)
-
+    if image is None: image = Image.open(io.BytesIO(image_bytes))
+    with _checkout_instances() as (thread_model, cascade):
+        results = thread_model(image)
+        person_detections, face_detections = _collect_detections(results, thread_model.names)
+        if not face_detections:
+            face_detections = [
+                {"box": box} for box in _detect_faces_in_person_boxes(image, [d['box'] for d in person_detections], cascade)
+            ]
+    return _build_analysis(image, person_detections, face_detections)
+
+def _collect_detections(results, names: dict) -> tuple:
     person_detections = []
     face_detections = []
 
@@ -33,23 +153,28 @@ def analyze(image_bytes: bytes) -> dict:
         for box in r.boxes:
             x1, y1, x2, y2 = box.xyxy[0]
             label_id = int(box.cls[0])
-            label_name = model.names[label_id]
+            label_name = names[label_id]
             confidence = float(box.conf[0])
             
             if label_name == 'person' and confidence > 0.6:
                 person_detections.append({"box": [int(x1), int(y1), int(x2), int(y2)]})
             if label_name == 'face' and confidence > 0.5:
                 face_detections.append({"box": [int(x1), int(y1), int(x2), int(y2)]})
+    return person_detections, face_detections
 
+def _build_analysis(image: Image.Image, person_detections: list, face_detections: list) -> dict:
     focus_point = (image.width // 2, image.height // 2)
     subject_top_y = 0
     main_box = None
 
     if face_detections:
-        main_box = max(face_detections, key=lambda d: (d['box'][2] - d['box'][0]) * (d['box'][3] - d['box'][1]))['box']
-        fp_x = main_box[0] + (main_box[2] - main_box[0]) / 2
-        fp_y = main_box[1] + (main_box[3] - main_box[1]) / 2.5
+        face_box = max(face_detections, key=lambda d: (d['box'][2] - d['box'][0]) * (d['box'][3] - d['box'][1]))['box']
+        fp_x = face_box[0] + (face_box[2] - face_box[0]) / 2
+        fp_y = face_box[1] + (face_box[3] - face_box[1]) / 2.5
         focus_point = (int(fp_x), int(fp_y))
+        # O enquadramento dimensiona pelo corpo: usa a pessoa que contém o rosto, quando houver.
+        main_box = next((d['box'] for d in person_detections
+                         if d['box'][0] <= fp_x <= d['box'][2] and d['box'][1] <= fp_y <= d['box'][3]), face_box)
     elif person_detections:
         main_box = max(person_detections, key=lambda d: (d['box'][2] - d['box'][0]) * (d['box'][3] - d['box'][1]))['box']
         fp_x = main_box[0] + (main_box[2] - main_box[0]) / 2
@@ -69,36 +194,6 @@ def analyze(image_bytes: bytes) -> dict:
         "face_boxes": [d['box'] for d in face_detections]
     }
 
-def analyze_logo_placement_area(image: Image.Image, fmt_config: dict) -> str:
-    """
-    Analisa a luminosidade da área onde o logo será aplicado para decidir
-    se a versão clara ou escura do logo deve ser usada.
-    """
-    rules = fmt_config.get('rules', {})
-    if 'margin' not in rules or 'logo_area' not in rules:
-        return 'dark' 
-
-    margin = rules['margin']
-    logo_area_dims = rules['logo_area']
-    
-    crop_box = (
-        margin['x'], margin['y'],
-        margin['x'] + logo_area_dims['width'],
-        margin['y'] + logo_area_dims['height']
-    )
-    crop_box = (
-        min(crop_box[0], image.width), min(crop_box[1], image.height),
-        min(crop_box[2], image.width), min(crop_box[3], image.height)
-    )
-
-    logo_placement_area = image.crop(crop_box).convert('L')
-    if logo_placement_area.width == 0 or logo_placement_area.height == 0:
-        return 'dark'
-
-    average_brightness = np.mean(np.array(logo_placement_area))
-
-    return 'light' if average_brightness < 115 else 'dark'
-
 def draw_detections_on_image(image_bytes: bytes, fmt_config: dict) -> bytes:
     """
     Desenha as detecções da IA para debug visual.
@@ -106,8 +201,9 @@ def draw_detections_on_image(image_bytes: bytes, fmt_config: dict) -> bytes:
     if not fmt_config:
         raise ValueError("A configuração do formato (fmt_config) é necessária.")
 
-    analysis = analyze(image_bytes)
-    original_image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    source_image = Image.open(io.BytesIO(image_bytes))
+    analysis = analyze(image_bytes, source_image)
+    original_image = source_image.convert('RGB')
     
     canvas_w, canvas_h = fmt_config['width'], fmt_config['height']
     final_canvas = Image.new('RGB', (canvas_w, canvas_h), (200, 200, 200))
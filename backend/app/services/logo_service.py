@@ -2,11 +2,55 @@ import os
 import base64
 import io
 import logging
+import threading
+from collections import OrderedDict
 from PIL import Image
 from fastapi import HTTPException
+from . import cache_service
 
 logger = logging.getLogger(__name__)
 LOGOS_BASE_PATH = "app/static/logos"
+# Logos recortados já decodificados, na frente do cache compartilhado: cada renderização
+# reutiliza os mesmos poucos logos em vários formatos.
+TRIMMED_LOGO_CACHE_SIZE = 16
+_trimmed_logo_cache = OrderedDict()
+_trimmed_logo_cache_lock = threading.Lock()
+
+def trimmed_logo_png(logo_bytes: bytes) -> bytes:
+    """
+    Retorna o logo em PNG sem o espaço transparente em volta. O resultado fica no
+    cache compartilhado, indexado pelo hash do arquivo original.
+    """
+    cache_key = cache_service.content_key(logo_bytes)
+    cached = cache_service.get('trimmed_logo', cache_key)
+    if cached is not None:
+        return cached
+
+    logo_image = Image.open(io.BytesIO(logo_bytes)).convert("RGBA")
+    bbox = logo_image.getbbox()
+    if bbox:
+        logo_image = logo_image.crop(bbox)
+
+    buffer = io.BytesIO()
+    logo_image.save(buffer, format="PNG")
+    trimmed_bytes = buffer.getvalue()
+    cache_service.put('trimmed_logo', cache_key, trimmed_bytes)
+    return trimmed_bytes
+
+def trimmed_logo_image(logo_bytes: bytes) -> Image.Image:
+    """Logo recortado (RGBA) já decodificado. Devolve uma cópia, que o chamador pode modificar."""
+    cache_key = cache_service.content_key(logo_bytes)
+    with _trimmed_logo_cache_lock:
+        if cache_key in _trimmed_logo_cache:
+            _trimmed_logo_cache.move_to_end(cache_key)
+            return _trimmed_logo_cache[cache_key].copy()
+
+    logo_image = Image.open(io.BytesIO(trimmed_logo_png(logo_bytes))).convert("RGBA")
+    with _trimmed_logo_cache_lock:
+        _trimmed_logo_cache[cache_key] = logo_image
+        while len(_trimmed_logo_cache) > TRIMMED_LOGO_CACHE_SIZE:
+            _trimmed_logo_cache.popitem(last=False)
+    return logo_image.copy()
 
 def list_logo_folders(query: str = ""):
     """
@@ -44,16 +88,7 @@ def list_logos_in_folder(folder_name: str):
                     original_logo_bytes = f.read()
 
                 if filename.lower().endswith('.png'):
-                    logo_image = Image.open(io.BytesIO(original_logo_bytes)).convert("RGBA")
-                    bbox = logo_image.getbbox()
-                    
-                    final_image_to_encode = logo_image
-                    if bbox:
-                        final_image_to_encode = logo_image.crop(bbox)
-
-                    buffer = io.BytesIO()
-                    final_image_to_encode.save(buffer, format="PNG")
-                    processed_logo_bytes = buffer.getvalue()
+                    processed_logo_bytes = trimmed_logo_png(original_logo_bytes)
                     logo_b64 = base64.b64encode(processed_logo_bytes).decode('utf-8')
                     file_type = 'png'
                 else: # SVG
@@ -0,0 +1,64 @@
+import numpy as np
+from PIL import Image
+
+AUTO_FILTER = 'auto'
+DARK_BACKGROUND_THRESHOLD = 115
+MIN_LOGO_CONTRAST = 60
+
+def build_luminance_table(image: Image.Image) -> dict:
+    """
+    Monta as tabelas de área somada (imagem integral) da luminância e do seu quadrado.
+    Depois de uma única passada pelos pixels, média e variância de qualquer retângulo saem em O(1).
+    """
+    luminance = np.asarray(image.convert('L'), dtype=np.int64)
+    height, width = luminance.shape
+    sums = np.zeros((height + 1, width + 1), dtype=np.int64)
+    sq_sums = np.zeros((height + 1, width + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(luminance, axis=0), axis=1, out=sums[1:, 1:])
+    np.cumsum(np.cumsum(luminance * luminance, axis=0), axis=1, out=sq_sums[1:, 1:])
+    return {"sum": sums, "sq_sum": sq_sums, "width": width, "height": height}
+
+def regions_stats(table: dict, boxes) -> tuple:
+    """
+    Média e variância da luminância para um lote de retângulos (x1, y1, x2, y2).
+    As caixas são recortadas aos limites da imagem; caixas vazias retornam média 0 e variância 0.
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    x1 = np.clip(boxes[:, 0], 0, table['width'])
+    y1 = np.clip(boxes[:, 1], 0, table['height'])
+    x2 = np.clip(boxes[:, 2], 0, table['width'])
+    y2 = np.clip(boxes[:, 3], 0, table['height'])
+    x2, y2 = np.maximum(x2, x1), np.maximum(y2, y1)
+
+    def box_sum(t): return t[y2, x2] - t[y1, x2] - t[y2, x1] + t[y1, x1]
+
+    area = (x2 - x1) * (y2 - y1)
+    safe_area = np.maximum(area, 1)
+    means = box_sum(table['sum']) / safe_area
+    variances = np.maximum(box_sum(table['sq_sum']) / safe_area - means * means, 0)
+    empty = area == 0
+    means[empty], variances[empty] = 0, 0
+    return means, variances
+
+def region_stats(table: dict, box) -> tuple:
+    """Média e variância da luminância de um único retângulo (x1, y1, x2, y2)."""
+    means, variances = regions_stats(table, [box])
+    return float(means[0]), float(variances[0])
+
+def logo_luminance(logo_img: Image.Image) -> float:
+    """Luminância média dos pixels visíveis do logo, ponderada pelo canal alfa."""
+    logo_img = logo_img.convert('RGBA')
+    alpha = np.asarray(logo_img.getchannel('A'), dtype=np.float64)
+    if alpha.sum() == 0: return None
+    luminance = np.asarray(logo_img.convert('L'), dtype=np.float64)
+    return float((luminance * alpha).sum() / alpha.sum())
+
+def pick_logo_filter(table: dict, box, logo_lum: float = None) -> str:
+    """
+    Escolhe o filtro do logo para a área em que ele será aplicado: mantém as cores
+    originais (None) quando já há contraste suficiente, senão 'white' ou 'black'.
+    """
+    mean, _ = region_stats(table, box)
+    if logo_lum is not None and abs(logo_lum - mean) >= MIN_LOGO_CONTRAST:
+        return None
+    return 'white' if mean < DARK_BACKGROUND_THRESHOLD else 'black'
@@ -0,0 +1,213 @@
+import asyncio
+import base64
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from ..core.config import settings
+from . import cache_service, composition_service
+
+logger = logging.getLogger(__name__)
+
+# Campanhas pré-renderizadas guardadas e pedidos aguardando a thread de fundo.
+PRERENDER_STORE_SIZE = 8
+PRERENDER_QUEUE_SIZE = 4
+# Prioridade (nice) da thread de pré-renderização no Linux; as threads que ela cria herdam o valor.
+BACKGROUND_NICENESS = 10
+# Cada worker do gunicorn tem a sua fila; o resultado e a marca de "em andamento" ficam no cache
+# compartilhado, para que a requisição seguinte o encontre em qualquer worker. Uma marca mais
+# antiga que PRERENDER_WAIT_SECONDS é considerada abandonada (worker reiniciado).
+PRERENDER_WAIT_SECONDS = 30
+PRERENDER_POLL_SECONDS = 0.1
+# Resultados guardados são especulativos: valem só para as requisições logo em seguida.
+PRERENDER_RESULT_TTL_SECONDS = 600
+
+class _Job:
+    def __init__(self, key: str, args: tuple, kwargs: dict):
+        self.key, self.args, self.kwargs = key, args, kwargs
+        self.future = concurrent.futures.Future()
+        self.promoted = False
+
+_condition = threading.Condition()
+_queue = deque()
+_jobs = {}
+_results = OrderedDict()
+_interactive = 0
+_worker = None
+_stats = {"scheduled": 0, "hits": 0, "promoted": 0, "dropped": 0}
+
+@contextlib.contextmanager
+def interactive():
+    """Marca trabalho interativo em andamento: a pré-renderização pausa até ele terminar."""
+    global _interactive
+    with _condition: _interactive += 1
+    try:
+        yield
+    finally:
+        with _condition:
+            _interactive -= 1
+            _condition.notify_all()
+
+def _yield_to_interactive(job: _Job):
+    """Chamado entre as etapas da renderização: espera enquanto houver requisições interativas."""
+    with _condition:
+        while _interactive > 0 and not job.promoted:
+            _condition.wait()
+
+def _lower_priority():
+    if not sys.platform.startswith('linux'): return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), BACKGROUND_NICENESS)
+    except OSError as e:
+        logger.warning(f"Não foi possível reduzir a prioridade da pré-renderização: {e}")
+
+def _encode_result(result: dict) -> dict:
+    formats = {name: {"image": base64.b64encode(data['image_bytes']).decode('ascii'), "composition_data": data['composition_data']}
+               for name, data in result.items()}
+    return {"stored": time.time(), "formats": formats}
+
+def _shared_result(key: str) -> dict:
+    stored = cache_service.get_json('prerender', key)
+    if stored is None or time.time() - stored['stored'] > PRERENDER_RESULT_TTL_SECONDS:
+        return None
+    return {name: {"image_bytes": base64.b64decode(data['image']), "composition_data": data['composition_data']}
+            for name, data in stored['formats'].items()}
+
+def _shared_status(key: str) -> str:
+    """'running' ou 'done' segundo o cache compartilhado (valendo para qualquer worker), ou None."""
+    status = cache_service.get_json('prerender_status', key)
+    if status is None: return None
+    age = time.time() - status['at']
+    if status['state'] == 'running': return 'running' if age < PRERENDER_WAIT_SECONDS else None
+    return 'done' if age < PRERENDER_RESULT_TTL_SECONDS else None
+
+def _running_elsewhere(key: str) -> bool:
+    return _shared_status(key) == 'running'
+
+def _run_worker():
+    _lower_priority()
+    while True:
+        with _condition:
+            while not _queue:
+                _condition.wait()
+            # O pedido mais recente primeiro: é o que reflete a escolha atual do usuário.
+            job = _queue.pop()
+        if not job.future.set_running_or_notify_cancel():
+            continue
+        cache_service.put_json('prerender_status', job.key, {"state": "running", "at": time.time()})
+        try:
+            result = composition_service.compose_all_formats_assigned(
+                *job.args, **job.kwargs, yield_point=functools.partial(_yield_to_interactive, job)
+            )
+        except Exception as e:
+            logger.warning(f"Falha na pré-renderização ({job.key[:12]}): {e}")
+            cache_service.delete('prerender_status', job.key)
+            job.future.set_exception(e)
+        else:
+            cache_service.put_json('prerender', job.key, _encode_result(result))
+            cache_service.put_json('prerender_status', job.key, {"state": "done", "at": time.time()})
+            with _condition:
+                _results[job.key] = result
+                while len(_results) > PRERENDER_STORE_SIZE:
+                    _results.popitem(last=False)
+            job.future.set_result(result)
+        finally:
+            with _condition:
+                _jobs.pop(job.key, None)
+
+def schedule(key: str, *args, **kwargs) -> bool:
+    """
+    Agenda a pré-renderização de uma campanha (argumentos de compose_all_formats_assigned)
+    com baixa prioridade. Retorna False se ela já está pronta, na fila ou desativada.
+    """
+    global _worker
+    if not settings.SPECULATIVE_PRERENDER:
+        return False
+    with _condition:
+        if key in _results or key in _jobs:
+            return False
+    # Outro worker já terminou ou está renderizando a mesma campanha.
+    if _shared_status(key) is not None:
+        return False
+    with _condition:
+        if key in _results or key in _jobs:
+            return False
+        job = _Job(key, args, kwargs)
+        _queue.append(job)
+        _jobs[key] = job
+        _stats["scheduled"] += 1
+        while len(_queue) > PRERENDER_QUEUE_SIZE:
+            dropped = _queue.popleft()
+            del _jobs[dropped.key]
+            dropped.future.cancel()
+            _stats["dropped"] += 1
+        if _worker is None:
+            _worker = threading.Thread(target=_run_worker, name="prerender", daemon=True)
+            _worker.start()
+        _condition.notify_all()
+    return True
+
+def _claim(key: str) -> concurrent.futures.Future:
+    with _condition:
+        if key in _results:
+            _results.move_to_end(key)
+            _stats["hits"] += 1
+            future = concurrent.futures.Future()
+            future.set_result(_results[key])
+            return future
+        job = _jobs.get(key)
+        if job is None:
+            return None
+        if job in _queue:
+            # Ainda não começou: sai da fila e a requisição renderiza normalmente.
+            _queue.remove(job)
+            del _jobs[key]
+            job.future.cancel()
+            return None
+        # Já em andamento: deixa de ceder às requisições interativas e é aguardada.
+        job.promoted = True
+        _stats["promoted"] += 1
+        _condition.notify_all()
+        return job.future
+
+async def claimed_result(key: str):
+    """
+    Resultado pré-renderizado para a chave, ou None. Procura primeiro neste processo e depois
+    no cache compartilhado; se outro worker ainda estiver renderizando, aguarda o resultado dele.
+    """
+    future = _claim(key)
+    if future is not None:
+        try:
+            return await asyncio.wrap_future(future)
+        except Exception:
+            return None
+
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, _shared_result, key)
+    while result is None and await loop.run_in_executor(None, _running_elsewhere, key):
+        await asyncio.sleep(PRERENDER_POLL_SECONDS)
+        result = await loop.run_in_executor(None, _shared_result, key)
+    if result is not None:
+        with _condition: _stats["hits"] += 1
+    return result
+
+def store_upload(image_bytes: bytes) -> str:
+    """Guarda uma imagem enviada no cache compartilhado e retorna o seu SHA-256."""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    if cache_service.get('upload', digest) is None:
+        cache_service.put('upload', digest, image_bytes)
+    return digest
+
+def load_upload(digest: str) -> bytes:
+    """Imagem enviada antes, pelo SHA-256, ou None se não estiver (mais) no cache."""
+    return cache_service.get('upload', digest)
+
+def stats() -> dict:
+    with _condition:
+        return {**_stats, "stored": len(_results), "queued": len(_queue), "interactive": _interactive}
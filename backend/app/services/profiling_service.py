@@ -0,0 +1,158 @@
+import contextlib
+import contextvars
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005
+PROFILES_KEEP = 100
+PROFILE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Perfil ativo da requisição atual; None (o padrão) mantém todo o caminho sem custo.
+_active_profile = contextvars.ContextVar('active_profile', default=None)
+
+class Profile:
+    """
+    Perfil por amostragem de uma requisição: uma thread auxiliar lê periodicamente a pilha
+    das threads que estão trabalhando para a requisição e conta as pilhas no formato
+    "collapsed stacks" (uma linha "a;b;c contagem" por pilha), aceito pelo flamegraph.pl e speedscope.
+    """
+    def __init__(self, label: str):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.samples = Counter()
+        self.saved = False
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id[:8]}", daemon=True)
+
+    @contextlib.contextmanager
+    def track(self, anchor=None):
+        """
+        Inclui a thread atual na amostragem enquanto o bloco executa. Com anchor (o frame
+        de uma corrotina), só contam as amostras em que esse frame está na pilha: no loop de
+        eventos, isso separa o trabalho da requisição da espera e das outras requisições.
+        """
+        ident = threading.get_ident()
+        with self._lock:
+            previous = self._threads.get(ident, False)
+            self._threads[ident] = anchor
+        try:
+            yield
+        finally:
+            with self._lock:
+                if previous is False: del self._threads[ident]
+                else: self._threads[ident] = previous
+
+    def _run(self):
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            with self._lock: threads = list(self._threads.items())
+            frames = sys._current_frames()
+            for ident, anchor in threads:
+                frame = frames.get(ident)
+                if frame is not None and (anchor is None or self._on_stack(frame, anchor)):
+                    self.samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _on_stack(frame, anchor) -> bool:
+        while frame is not None:
+            if frame is anchor: return True
+            frame = frame.f_back
+        return False
+
+    def _collapse(self, frame) -> str:
+        stack = []
+        while frame is not None:
+            stack.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}")
+            frame = frame.f_back
+        stack.append(self.label)
+        return ';'.join(reversed(stack))
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+
+def is_authorized(token: str) -> bool:
+    """Perfis só podem ser pedidos e lidos com o token configurado (PROFILING_TOKEN)."""
+    return bool(settings.PROFILING_TOKEN and token) and hmac.compare_digest(token, settings.PROFILING_TOKEN)
+
+def is_active() -> bool:
+    return _active_profile.get() is not None
+
+def traced(func):
+    """
+    Prepara func para rodar em outra thread (executor, pool) sem perder o perfil da
+    requisição. Sem perfil ativo, devolve a própria função.
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return func
+
+    def run_traced(*args, **kwargs):
+        token = _active_profile.set(profile)
+        try:
+            with profile.track():
+                return func(*args, **kwargs)
+        finally:
+            _active_profile.reset(token)
+    return run_traced
+
+@contextlib.contextmanager
+def profile_request(label: str):
+    """
+    Ativa o perfil para o bloco (a requisição) e grava as pilhas coletadas ao final.
+    Perfis sem nenhuma amostra não são gravados (profile.saved fica False).
+    """
+    profile = Profile(label)
+    token = _active_profile.set(profile)
+    profile.start()
+    started = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _active_profile.reset(token)
+        _save(profile, time.perf_counter() - started)
+
+def _profile_path(profile_id: str) -> str:
+    return os.path.join(settings.PROFILES_DIR, f"{profile_id}.folded")
+
+def _save(profile: Profile, elapsed: float):
+    if not profile.samples:
+        logger.info(f"Perfil {profile.id} ({profile.label}): {elapsed:.2f}s, nenhuma amostra coletada; não foi gravado.")
+        return
+    try:
+        os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+        with open(_profile_path(profile.id), 'w', encoding='utf-8') as f:
+            for stack, count in profile.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        profile.saved = True
+        logger.info(f"Perfil {profile.id} ({profile.label}): {elapsed:.2f}s, {sum(profile.samples.values())} amostras.")
+        _prune()
+    except OSError as e:
+        logger.warning(f"Falha ao gravar o perfil {profile.id}: {e}")
+
+def _prune():
+    files = [os.path.join(settings.PROFILES_DIR, f) for f in os.listdir(settings.PROFILES_DIR) if f.endswith('.folded')]
+    for path in sorted(files, key=os.path.getmtime)[:-PROFILES_KEEP]:
+        os.remove(path)
+
+def load_profile(profile_id: str) -> str:
+    """Conteúdo de um perfil gravado, ou None se o id for inválido ou não existir."""
+    if not PROFILE_ID_PATTERN.match(profile_id or '') or not os.path.exists(_profile_path(profile_id)):
+        return None
+    with open(_profile_path(profile_id), 'r', encoding='utf-8') as f:
+        return f.read()
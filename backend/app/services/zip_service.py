@@ -1,6 +1,11 @@
 import io
+import logging
+import os
 import zipfile
 from typing import Dict
+from PIL import Image
+
+logger = logging.getLogger(__name__)
 
 def create_zip_from_images(images: Dict[str, bytes]) -> io.BytesIO:
     zip_buffer = io.BytesIO()
@@ -9,4 +14,27 @@ def create_zip_from_images(images: Dict[str, bytes]) -> io.BytesIO:
         for name, data in images.items():
             zipf.writestr(name, data)
     
-    return zip_buffer
\ No newline at end of file
+    return zip_buffer
+
+def create_campaign_zip(campaign_id: str, images: Dict[str, bytes]) -> io.BytesIO:
+    """Monta o ZIP de entrega de uma campanha: pasta images_<id>, com o BRAND_LOGO convertido para PNG."""
+    images_to_zip = {}
+    folder_name = f"images_{campaign_id}"
+
+    for filename, image_bytes in images.items():
+        final_filename = filename
+
+        if filename == 'BRAND_LOGO.jpg':
+            final_filename = 'BRAND_LOGO.png'
+            try:
+                img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
+                png_buffer = io.BytesIO()
+                img.save(png_buffer, format='PNG')
+                image_bytes = png_buffer.getvalue()
+            except Exception as e:
+                logger.error(f"Falha ao converter BRAND_LOGO para PNG: {e}")
+                final_filename = filename
+        
+        images_to_zip[os.path.join(folder_name, final_filename)] = image_bytes
+
+    return create_zip_from_images(images_to_zip)
@@ -52,16 +52,19 @@ export const getFormatsConfig = async () => {
 
 /**
  * Envia as imagens e configurações para gerar múltiplas pré-visualizações.
- * @param {Object} files - Contém imageA e imageB.
- * @param {Object} assignments - Mapeia cada formato para 'imageA' ou 'imageB'.
+ * @param {Object} files - Mapeia a chave de cada imagem (ex.: imageA, imageB) para o seu arquivo.
+ * @param {Object} assignments - Mapeia cada formato para a chave de uma das imagens.
  * @param {Array} selectedLogos - Lista de logos selecionados para a campanha.
  * @param {Object} overrides - Configurações manuais de edição para cada formato.
+ * @param {string} quality - 'final' (padrão, usado na exportação) ou 'draft' (rascunho reduzido e mais rápido)
  * @returns {Promise<Object>} Um objeto com os dados das pré-visualizações geradas.
  */
-export const getPreviews = async (files, assignments, selectedLogos, overrides = {}) => {
+export const getPreviews = async (files, assignments, selectedLogos, overrides = {}, quality = 'final') => {
     const formData = new FormData();
-    formData.append('imageA', files.imageA);
-    formData.append('imageB', files.imageB);
+    formData.append('quality', quality);
+    const imageKeys = Object.keys(files).filter(key => files[key]);
+    imageKeys.forEach(key => formData.append('images', files[key]));
+    formData.append('image_keys', JSON.stringify(imageKeys));
 
     const logosForApi = selectedLogos.map(logo => ({ folder: logo.folder, filename: logo.filename }));
     formData.append('selected_logos', JSON.stringify(logosForApi));
@@ -78,20 +81,114 @@ export const getPreviews = async (files, assignments, selectedLogos, overrides =
     return response.data.previews;
 };
 
+// SHA-256 de cada arquivo, calculado uma vez: o prefetch manda só os hashes das imagens
+// que o servidor já recebeu, em vez de reenviar os arquivos a cada edição.
+const fileHashes = new WeakMap();
+
+const hashFile = (file) => {
+    if (!fileHashes.has(file)) {
+        const digest = file.arrayBuffer()
+            .then(buffer => crypto.subtle.digest('SHA-256', buffer))
+            .then(hash => Array.from(new Uint8Array(hash), byte => byte.toString(16).padStart(2, '0')).join(''));
+        fileHashes.set(file, digest);
+    }
+    return fileHashes.get(file);
+};
+
+/**
+ * Pede ao servidor que pré-renderize em segundo plano as pré-visualizações da campanha,
+ * para que a chamada a getPreviews com os mesmos dados responda com o resultado pronto.
+ * As imagens vão pelo SHA-256; só as que o servidor ainda não tem são enviadas.
+ * @param {Object} files - Mapeia a chave de cada imagem (ex.: imageA, imageB) para o seu arquivo.
+ * @param {Object} assignments - Mapeia cada formato para a chave de uma das imagens.
+ * @param {Array} selectedLogos - Lista de logos selecionados para a campanha.
+ * @param {Object} overrides - Configurações manuais de edição para cada formato.
+ * @param {string} quality - O mesmo tier que será pedido depois a getPreviews.
+ * @returns {Promise<boolean>} Se o servidor agendou a pré-renderização.
+ */
+export const prefetchPreviews = async (files, assignments, selectedLogos, overrides = {}, quality = 'final') => {
+    const imageKeys = Object.keys(files).filter(key => files[key]);
+    // crypto.subtle só existe em contexto seguro (HTTPS ou localhost); sem ele, envia os arquivos.
+    const hashes = {};
+    if (globalThis.crypto?.subtle) {
+        for (const key of imageKeys) hashes[key] = await hashFile(files[key]);
+    }
+
+    const send = async (uploadKeys) => {
+        const formData = new FormData();
+        formData.append('quality', quality);
+        uploadKeys.forEach(key => formData.append('images', files[key]));
+        if (uploadKeys.length > 0) formData.append('image_keys', JSON.stringify(uploadKeys));
+        const hashedKeys = imageKeys.filter(key => !uploadKeys.includes(key));
+        if (hashedKeys.length > 0) {
+            formData.append('image_hashes', JSON.stringify(Object.fromEntries(hashedKeys.map(key => [key, hashes[key]]))));
+        }
+
+        const logosForApi = selectedLogos.map(logo => ({ folder: logo.folder, filename: logo.filename }));
+        formData.append('selected_logos', JSON.stringify(logosForApi));
+
+        const assignmentsBlob = new Blob([JSON.stringify(assignments)], { type: 'application/json' });
+        formData.append('assignments', assignmentsBlob, 'assignments.json');
+
+        const overridesBlob = new Blob([JSON.stringify(overrides)], { type: 'application/json' });
+        formData.append('overrides', overridesBlob, 'overrides.json');
+
+        const response = await apiClient.post('/prefetch-previews', formData);
+        return response.data;
+    };
+
+    let data = await send(imageKeys.filter(key => !hashes[key]));
+    if (data.missing?.length) {
+        // O servidor ainda não tem (ou já descartou) essas imagens: envia só elas.
+        data = await send(data.missing);
+    }
+    return data.scheduled;
+};
+
+/**
+ * Busca apenas a geometria do layout de cada formato (enquadramento, logos e tagline),
+ * sem que o servidor renderize as imagens. Útil para desenhar pré-visualizações no navegador.
+ * @param {Object} files - Mapeia a chave de cada imagem (ex.: imageA, imageB) para o seu arquivo.
+ * @param {Object} assignments - Mapeia cada formato para a chave de uma das imagens.
+ * @param {Array} selectedLogos - Lista de logos selecionados para a campanha.
+ * @param {Object} overrides - Configurações manuais de edição para cada formato.
+ * @returns {Promise<Object>} Um objeto com o plano de layout de cada formato.
+ */
+export const getLayoutPlans = async (files, assignments, selectedLogos, overrides = {}) => {
+    const formData = new FormData();
+    const imageKeys = Object.keys(files).filter(key => files[key]);
+    imageKeys.forEach(key => formData.append('images', files[key]));
+    formData.append('image_keys', JSON.stringify(imageKeys));
+
+    const logosForApi = selectedLogos.map(logo => ({ folder: logo.folder, filename: logo.filename }));
+    formData.append('selected_logos', JSON.stringify(logosForApi));
+
+    const assignmentsBlob = new Blob([JSON.stringify(assignments)], { type: 'application/json' });
+    formData.append('assignments', assignmentsBlob, 'assignments.json');
+
+    const overridesBlob = new Blob([JSON.stringify(overrides)], { type: 'application/json' });
+    formData.append('overrides', overridesBlob, 'overrides.json');
+
+    const response = await apiClient.post('/plan-layouts', formData);
+    return response.data.layouts;
+};
+
 /**
  * Gera uma única pré-visualização para um formato específico, usado após edições manuais
  * @param {string} formatName - O nome do formato 
  * @param {File} imageFile - O arquivo de imagem a ser usado
  * @param {Array} logosInfo - Informações sobre os logos a serem aplicados
  * @param {Object} override - As configurações de edição para este formato
+ * @param {string} quality - 'final' (padrão, usado na exportação) ou 'draft' (rascunho reduzido e mais rápido)
  * @returns {Promise<Blob>} A imagem de pré-visualização gerada como um Blob
  */
-export const getSinglePreview = async (formatName, imageFile, logosInfo, override) => {
+export const getSinglePreview = async (formatName, imageFile, logosInfo, override, quality = 'final') => {
     const formData = new FormData();
     
     formData.append('file', imageFile);
     formData.append('format_name', formatName.replace('.jpg', ''));
     formData.append('selected_logos', JSON.stringify(logosInfo));
+    formData.append('quality', quality);
 
     const overrideJson = JSON.stringify(override); 
     const overrideBlob = new Blob([overrideJson], { type: 'application/json' });
@@ -58,7 +58,7 @@ function ImageEditorModal({ preview, onClose, onSave, globalTaglineState }) {
                     id: `${logo.folder}-${logo.filename}`, data: logo.data, aspectRatio,
                     x: override.x ?? (rules?.margin?.x ?? 20), y: override.y ?? defaultY,
                     width: override.width ?? (rules?.logo_area?.width ?? 150),
-                    colorFilter: override.color_filter ?? 'none',
+                    colorFilter: override.color_filter ?? 'auto',
                 });
             };
             img.src = logo.data;
@@ -194,6 +194,7 @@ function ImageEditorModal({ preview, onClose, onSave, globalTaglineState }) {
                                     />
                                 </div>
                                 <div className="logo-filter-buttons">
+                                    <button className={state.colorFilter === 'auto' ? 'active' : ''} onClick={() => handleLogoChange(index, { colorFilter: 'auto' })}>Auto</button>
                                     <button className={state.colorFilter === 'none' ? 'active' : ''} onClick={() => handleLogoChange(index, { colorFilter: 'none' })}>Original</button>
                                     <button className={state.colorFilter === 'white' ? 'active' : ''} onClick={() => handleLogoChange(index, { colorFilter: 'white' })}>Branco</button>
                                     <button className={state.colorFilter === 'black' ? 'active' : ''} onClick={() => handleLogoChange(index, { colorFilter: 'black' })}>Preto</button>
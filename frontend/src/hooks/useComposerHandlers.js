@@ -1,6 +1,7 @@
 import { useEffect } from 'react';
 import {
     getPreviews,
+    prefetchPreviews,
     getSinglePreview,
     listLogoFolders,
     listLogosInFolder,
@@ -10,6 +11,17 @@ import {
 } from '../api/composerApi';
 import { FORMAT_ORDER, IMAGE_A_ID, IMAGE_B_ID } from '../constants';
 
+// As pré-visualizações da tela usam o tier rascunho (reduzido e mais rápido); o ZIP é
+// montado com o tier final, renderizado na exportação a partir dos dados de cada slot.
+const PREVIEW_QUALITY = 'draft';
+const ENTREGA_DEPENDENCIES = ['SLOT1_WEB.jpg', 'SHOWROOM_MOBILE.jpg', 'HOME_PRIVATE.jpg'];
+
+const blobToBase64 = (blob) => new Promise((resolve) => {
+    const reader = new FileReader();
+    reader.readAsDataURL(blob);
+    reader.onloadend = () => resolve(reader.result.split(',')[1]);
+});
+
 const formatPairs = {
     'SLOT1_WEB.jpg': 'SLOT1_WEB_PRE.jpg',
     'SLOT1_WEB_PRE.jpg': 'SLOT1_WEB.jpg',
@@ -153,16 +165,9 @@ export function useComposerHandlers(state, setState) {
                 const imageFile = files[assignedImageId];
                 const logosInfoForApi = selectedLogos.map(l => ({ folder: l.folder, filename: l.filename }));
                 
-                const imageBlob = await getSinglePreview(name, imageFile, logosInfoForApi, saveData);
-                
-                return new Promise((resolve) => {
-                    const reader = new FileReader();
-                    reader.readAsDataURL(imageBlob);
-                    reader.onloadend = () => {
-                        const base64data = reader.result.split(',')[1];
-                        resolve({ name, data: base64data });
-                    };
-                });
+                const imageBlob = await getSinglePreview(name, imageFile, logosInfoForApi, saveData, PREVIEW_QUALITY);
+                const render = { file: imageFile, logos: logosInfoForApi, override: saveData };
+                return { name, data: await blobToBase64(imageBlob), render };
             };
 
             const regenerationPromises = [regeneratePreview(formatName)];
@@ -179,15 +184,15 @@ export function useComposerHandlers(state, setState) {
                     nextPreviewsState[result.name] = { 
                         ...previews[result.name], 
                         data: result.data, 
-                        composition_data: saveData 
+                        composition_data: saveData,
+                        render: result.render
                     };
                 }
             });
             setPreviews(nextPreviewsState);
 
-            const entregaDependencies = ['SLOT1_WEB.jpg', 'SHOWROOM_MOBILE.jpg', 'HOME_PRIVATE.jpg'];
-            if (entregaDependencies.some(dep => dep === formatName || dep === siblingFormat)) {
-                if (entregaDependencies.every(dep => nextPreviewsState[dep]?.data)) {
+            if (ENTREGA_DEPENDENCIES.some(dep => dep === formatName || dep === siblingFormat)) {
+                if (ENTREGA_DEPENDENCIES.every(dep => nextPreviewsState[dep]?.data)) {
                     setStatusMessage("Atualizando o formato de Entrega...");
                     const entregaBlob = await getEntregaPreview(nextPreviewsState);
                     const entregaReader = new FileReader();
@@ -212,15 +217,8 @@ export function useComposerHandlers(state, setState) {
         }
     };
 
-    const handleGeneratePreviews = async () => {
-        if (!files.imageA || !files.imageB || selectedLogos.length === 0) {
-            alert("Por favor, suba ambas as imagens e selecione pelo menos um logo.");
-            return;
-        }
-
-        setIsLoading(true);
-        setStatusMessage("Gerando pré-visualizações...");
-
+    // Monta as atribuições e overrides enviados ao gerar as pré-visualizações (slots travados ficam de fora).
+    const buildGenerationRequest = () => {
         const assignmentsForGeneration = {};
         const overridesForGeneration = {};
         const preservedPreviews = {};
@@ -242,7 +240,19 @@ export function useComposerHandlers(state, setState) {
                 }
             }
         });
+        return { assignmentsForGeneration, overridesForGeneration, preservedPreviews };
+    };
+
+    const handleGeneratePreviews = async () => {
+        if (!files.imageA || !files.imageB || selectedLogos.length === 0) {
+            alert("Por favor, suba ambas as imagens e selecione pelo menos um logo.");
+            return;
+        }
 
+        setIsLoading(true);
+        setStatusMessage("Gerando pré-visualizações...");
+
+        const { assignmentsForGeneration, overridesForGeneration, preservedPreviews } = buildGenerationRequest();
         setPreviews(preservedPreviews);
 
         try {
@@ -251,8 +261,20 @@ export function useComposerHandlers(state, setState) {
                     files,
                     assignmentsForGeneration,
                     selectedLogos,
-                    overridesForGeneration
+                    overridesForGeneration,
+                    PREVIEW_QUALITY
                 );
+                // Guarda com cada slot o que o gerou, para renderizá-lo no tier final ao exportar.
+                const logosForApi = selectedLogos.map(l => ({ folder: l.folder, filename: l.filename }));
+                Object.keys(newPreviewData).forEach(name => {
+                    if (assignmentsForGeneration[name]) {
+                        newPreviewData[name].render = {
+                            file: files[assignmentsForGeneration[name]],
+                            logos: logosForApi,
+                            override: overridesForGeneration[name]
+                        };
+                    }
+                });
                 setPreviews(prev => ({ ...prev, ...newPreviewData }));
             }
             
@@ -267,6 +289,41 @@ export function useComposerHandlers(state, setState) {
         }
     };
 
+    // Renderiza no tier final os slots exibidos como rascunho, com as mesmas imagens, logos e
+    // edições que os geraram (inclusive os travados), e refaz a Entrega a partir deles.
+    const renderFinalPreviews = async () => {
+        const groups = new Map();
+        Object.entries(previews).forEach(([formatName, preview]) => {
+            if (!preview?.render) return;
+            const { file, logos: renderLogos, override } = preview.render;
+            const groupKey = JSON.stringify(renderLogos);
+            if (!groups.has(groupKey)) {
+                groups.set(groupKey, { logos: renderLogos, files: {}, fileKeys: new Map(), assignments: {}, overrides: {} });
+            }
+            const group = groups.get(groupKey);
+            if (!group.fileKeys.has(file)) {
+                const key = `image${group.fileKeys.size}`;
+                group.fileKeys.set(file, key);
+                group.files[key] = file;
+            }
+            group.assignments[formatName] = group.fileKeys.get(file);
+            if (override) group.overrides[formatName] = override;
+        });
+
+        const finalPreviews = { ...previews };
+        for (const group of groups.values()) {
+            const rendered = await getPreviews(group.files, group.assignments, group.logos, group.overrides, 'final');
+            Object.keys(group.assignments).forEach(name => {
+                if (rendered[name]) finalPreviews[name] = { ...finalPreviews[name], data: rendered[name].data };
+            });
+        }
+        if (groups.size > 0 && ENTREGA_DEPENDENCIES.every(dep => finalPreviews[dep]?.data)) {
+            const entregaBase64 = await blobToBase64(await getEntregaPreview(finalPreviews));
+            finalPreviews['ENTREGA.jpg'] = { ...finalPreviews['ENTREGA.jpg'], data: entregaBase64 };
+        }
+        return finalPreviews;
+    };
+
     const handleDownloadZip = async () => {
         const campaignId = window.prompt("Por favor, insira o ID da campanha:", "");
         if (!campaignId || campaignId.trim() === "") {
@@ -275,10 +332,12 @@ export function useComposerHandlers(state, setState) {
         }
 
         setIsLoading(true);
-        setStatusMessage("Preparando e compactando arquivos...");
+        setStatusMessage("Renderizando os formatos em qualidade final...");
 
         try {
-            const zipBlob = await generateAndDownloadZip(campaignId.trim(), previews);
+            const finalPreviews = await renderFinalPreviews();
+            setStatusMessage("Preparando e compactando arquivos...");
+            const zipBlob = await generateAndDownloadZip(campaignId.trim(), finalPreviews);
             const url = window.URL.createObjectURL(new Blob([zipBlob]));
             const link = document.createElement('a');
             link.href = url;
@@ -306,6 +365,19 @@ export function useComposerHandlers(state, setState) {
         }));
     };
 
+    // Assim que imagens, atribuições e logos estão definidos, o servidor começa a pré-renderizar
+    // em segundo plano; "Gerar pré-visualizações" costuma então receber o resultado já pronto.
+    useEffect(() => {
+        if (!files.imageA || !files.imageB || selectedLogos.length === 0) return;
+        const timer = setTimeout(() => {
+            const { assignmentsForGeneration, overridesForGeneration } = buildGenerationRequest();
+            if (Object.keys(assignmentsForGeneration).length === 0) return;
+            prefetchPreviews(files, assignmentsForGeneration, selectedLogos, overridesForGeneration, PREVIEW_QUALITY)
+                .catch(error => console.warn("Pré-renderização em segundo plano não agendada:", error));
+        }, 800);
+        return () => clearTimeout(timer);
+    }, [files, assignments, selectedLogos, manualOverrides, taglineState, lockedSlots]);
+
     useEffect(() => {
         if (selectedFolder) {
             const fetchLogos = async () => {